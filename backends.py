@@ -0,0 +1,90 @@
+"""Бэкенды инференса: Keras, TFLite и ONNX Runtime с общим интерфейсом predict_on_batch."""
+
+import os
+
+import numpy as np
+
+BACKENDS = ("keras", "tflite", "onnx")
+
+
+def backend_for_path(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".tflite":
+        return "tflite"
+    if ext == ".onnx":
+        return "onnx"
+    return "keras"
+
+
+def cpu_threads():
+    return os.cpu_count() or 1
+
+
+class TFLiteModel(object):
+    def __init__(self, path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.path = path
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads or cpu_threads())
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        # Размеры, не заданные при экспорте (пакет, а у модели с предобработкой в графе -
+        # ещё высота и ширина), в shape_signature равны -1
+        signature = self.input_detail.get('shape_signature', self.input_detail['shape'])
+        self.input_shape = (None,) + tuple(int(d) if d > 0 else None for d in signature[1:])
+        self.allocated_shape = None
+
+    def _resize(self, shape):
+        if shape != self.allocated_shape:
+            self.interpreter.resize_tensor_input(self.input_detail['index'], shape)
+            self.interpreter.allocate_tensors()
+            self.input_detail = self.interpreter.get_input_details()[0]
+            self.output_detail = self.interpreter.get_output_details()[0]
+            self.allocated_shape = shape
+
+    def predict_on_batch(self, X):
+        self._resize(tuple(X.shape))
+        scale, zero_point = self.input_detail['quantization']
+        if self.input_detail['dtype'] != np.float32 and scale:
+            # Модель с целочисленным входом: квантуем как при калибровке
+            X = np.round(X / scale + zero_point)
+            info = np.iinfo(self.input_detail['dtype'])
+            X = np.clip(X, info.min, info.max)
+        self.interpreter.set_tensor(self.input_detail['index'], X.astype(self.input_detail['dtype'], copy=False))
+        self.interpreter.invoke()
+        out = self.interpreter.get_tensor(self.output_detail['index'])
+        scale, zero_point = self.output_detail['quantization']
+        if out.dtype != np.float32 and scale:
+            out = (out.astype(np.float32) - zero_point) * scale
+        return out
+
+
+class OnnxModel(object):
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+        self.path = path
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or cpu_threads()
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Динамические размеры ONNX - строки или None
+        self.input_shape = (None,) + tuple(d if isinstance(d, int) else None for d in model_input.shape[1:])
+
+    def predict_on_batch(self, X):
+        return self.session.run(None, {self.input_name: np.asarray(X, dtype=np.float32)})[0]
+
+
+def load_backend(path, backend=None):
+    backend = backend or backend_for_path(path)
+    if backend == "tflite":
+        return TFLiteModel(path)
+    if backend == "onnx":
+        return OnnxModel(path)
+    if backend == "keras":
+        from tensorflow.keras.models import load_model
+        from model_preprocessing import CUSTOM_OBJECTS
+        return load_model(path, custom_objects=CUSTOM_OBJECTS, compile=False)
+    raise ValueError(f"Неизвестный бэкенд: {backend} (доступны: {', '.join(BACKENDS)})")
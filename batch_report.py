@@ -0,0 +1,218 @@
+"""Пакетные PDF-отчёты по парам том/разметка без графического интерфейса.
+
+Примеры:
+    python batch_report.py /data/BraTS2020_ValidationData --labels /data/segmentations -o /data/reports
+    python batch_report.py /data/BraTS2020_ValidationData --labels /data/segmentations --combined -o night.pdf
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate
+
+from batch_segment import find_cases, output_path_for
+from report import REPORT_CLASS_NAMES, case_summary, summary_elements
+from study import NIFTI_EXTENSIONS, study_files
+from volume_io import load_volume
+
+
+def find_labels(case_id, files, labels_dir=None):
+    # Результат batch_segment.py (<case>_seg.nii.gz) в каталоге разметки или *_seg.nii рядом с томом
+    if labels_dir is not None:
+        path = output_path_for(labels_dir, case_id)
+        for ext in NIFTI_EXTENSIONS:
+            candidate = path[:-len(".nii.gz")] + ext
+            if os.path.exists(candidate):
+                return candidate
+        return None
+    return study_files(files[0]).get("seg")
+
+
+def find_pairs(inputs, labels_dir=None):
+    pairs, missing = [], []
+    for case_id, files in find_cases(inputs):
+        label_path = find_labels(case_id, files, labels_dir)
+        if label_path is None:
+            missing.append(case_id)
+        else:
+            pairs.append((case_id, files[0], label_path))
+    return pairs, missing
+
+
+def summarize_case(case_id, image_path, label_path):
+    # В рабочем процессе живут только тома текущего случая; обратно уходит сводка с PNG
+    image = load_volume(image_path)
+    labels = np.asarray(load_volume(label_path).data, dtype=np.uint8)
+    # В исходной разметке BraTS активная опухоль - метка 4, у модели - класс 3
+    labels[labels == 4] = 3
+    return case_summary(image.data, labels, image, title=f"Brain Tumor Segmentation: {case_id}")
+
+
+def write_case_report(case_id, image_path, label_path, output_path):
+    summary = summarize_case(case_id, image_path, label_path)
+    SimpleDocTemplate(output_path, pagesize=letter).build(summary_elements(summary))
+    summary["slices"] = None
+    return summary
+
+
+PDF_REFERENCE = re.compile(rb"(\d+) 0 R")
+PDF_STREAM = re.compile(rb">>\s*stream\r?\n")
+
+
+class CombinedPdf(object):
+    # Один PDF из отчётов отдельных случаев: страницы каждого файла ReportLab дописываются
+    # в выходной файл по мере готовности, в памяти - только текущий случай и смещения
+    # объектов. Объекты 1 и 2 (дерево страниц и каталог) пишутся в close()
+    PAGES, CATALOG = 1, 2
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(b"%PDF-1.4\n%\x93\x8c\x8b\x9e\n")
+        self.offsets = [0, None, None]
+        self.pages = []
+
+    def append(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        xref = int(re.search(rb"startxref\s+(\d+)", data[-1024:]).group(1))
+        trailer = data[xref:]
+        # Объекты ReportLab идут подряд: каждый заканчивается там, где начинается следующий
+        offsets = {int(m.group(1)): m.start() for m in re.finditer(rb"(?m)^(\d+) 0 obj", data[:xref])}
+        ends = dict(zip(sorted(offsets, key=offsets.get), sorted(offsets.values())[1:] + [xref]))
+        objects = {n: data[offsets[n]:ends[n]] for n in offsets}
+
+        root = int(re.search(rb"/Root (\d+) 0 R", trailer).group(1))
+        info = re.search(rb"/Info (\d+) 0 R", trailer)
+        pages_root = int(re.search(rb"/Pages (\d+) 0 R", objects[root]).group(1))
+        # Каталог, сведения о документе и деревья страниц заменяются общими
+        skipped = {root, pages_root} | ({int(info.group(1))} if info else set())
+        kids = self.page_ids(objects, pages_root, skipped)
+        kept = [n for n in sorted(objects) if n not in skipped]
+        numbers = dict.fromkeys(skipped, self.PAGES)
+        numbers.update(zip(kept, range(len(self.offsets), len(self.offsets) + len(kept))))
+        for n in kept:
+            self.write_object(numbers[n], objects[n], numbers)
+        self.pages.extend(numbers[n] for n in kids)
+
+    @staticmethod
+    def page_ids(objects, pages_id, skipped):
+        ids = []
+        kids = re.search(rb"/Kids \[([^\]]*)\]", objects[pages_id]).group(1)
+        for kid in map(int, PDF_REFERENCE.findall(kids)):
+            if b"/Type /Pages" in objects[kid]:
+                skipped.add(kid)
+                ids.extend(CombinedPdf.page_ids(objects, kid, skipped))
+            else:
+                ids.append(kid)
+        return ids
+
+    def write_object(self, number, body, numbers):
+        # Ссылки переписываются только в словаре объекта, данные потока копируются как есть
+        body = body.split(b" 0 obj", 1)[1]
+        stream = PDF_STREAM.search(body)
+        head, tail = (body[:stream.start()], body[stream.start():]) if stream else (body, b"")
+        head = PDF_REFERENCE.sub(lambda m: b"%d 0 R" % numbers[int(m.group(1))], head)
+        self.offsets.append(self.file.tell())
+        self.file.write(b"%d 0 obj" % number + head + tail)
+
+    def write_root(self, number, body):
+        self.offsets[number] = self.file.tell()
+        self.file.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % n for n in self.pages)
+        self.write_root(self.PAGES, b"<< /Count %d /Kids [ %s ] /Type /Pages >>" % (len(self.pages), kids))
+        self.write_root(self.CATALOG, b"<< /Pages %d 0 R /Type /Catalog >>" % self.PAGES)
+        xref = self.file.tell()
+        self.file.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self.offsets))
+        for offset in self.offsets[1:]:
+            self.file.write(b"%010d 00000 n \n" % offset)
+        self.file.write(b"trailer\n<< /Root %d 0 R /Size %d >>\nstartxref\n%d\n%%%%EOF\n"
+                        % (self.CATALOG, len(self.offsets), xref))
+        self.file.close()
+
+
+def iter_results(pool, func, jobs, in_flight):
+    # Не больше in_flight случаев в работе одновременно: память ограничена числом
+    # процессов, а не числом случаев, и результаты идут в исходном порядке
+    pending = []
+    jobs = iter(jobs)
+    for job in jobs:
+        pending.append((job, pool.submit(func, *job)))
+        if len(pending) >= in_flight:
+            break
+    while pending:
+        job, future = pending.pop(0)
+        next_job = next(jobs, None)
+        if next_job is not None:
+            pending.append((next_job, pool.submit(func, *next_job)))
+        try:
+            yield job, future.result(), None
+        except Exception as e:
+            yield job, None, e
+
+
+def summary_line(summary):
+    volumes = summary["volumes"]
+    return ", ".join(f"{REPORT_CLASS_NAMES[cls]} {volumes[cls] / 1000:.1f} мл" for cls in sorted(REPORT_CLASS_NAMES))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетные отчёты по сегментации опухолей мозга")
+    parser.add_argument("inputs", nargs="+", help="каталоги случаев BraTS или файлы NIfTI")
+    parser.add_argument("--labels", default=None,
+                        help="каталог с <case>_seg.nii.gz (по умолчанию *_seg.nii в каталоге случая)")
+    parser.add_argument("-o", "--output", required=True, help="каталог для отчётов или файл .pdf с --combined")
+    parser.add_argument("--combined", action="store_true", help="один PDF со всеми случаями")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="рабочих процессов")
+    args = parser.parse_args(argv)
+
+    pairs, missing = find_pairs(args.inputs, args.labels)
+    print(f"Найдено случаев: {len(pairs)}, без разметки: {len(missing)}")
+    if not pairs:
+        return 1 if missing else 0
+
+    # С --combined отчёты случаев пишутся во временный каталог и сразу дописываются в общий PDF
+    scratch = tempfile.TemporaryDirectory(prefix="batch_report-") if args.combined else None
+    output_dir = scratch.name if args.combined else args.output
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(case_id, image, labels, os.path.join(output_dir, f"{i:06d}_{case_id}.pdf" if args.combined
+                                                  else f"{case_id}_report.pdf"))
+            for i, (case_id, image, labels) in enumerate(pairs)]
+    combined = None
+
+    failed = 0
+    start = time.perf_counter()
+    # spawn: рабочим процессам не нужны потоки и состояние родителя
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for i, (job, summary, error) in enumerate(iter_results(pool, write_case_report, jobs, 2 * args.workers)):
+            case_id = job[0]
+            if error is not None:
+                failed += 1
+                print(f"[{i + 1}/{len(jobs)}] {case_id}: ошибка: {error}", file=sys.stderr)
+                continue
+            if args.combined:
+                combined = combined or CombinedPdf(args.output)
+                combined.append(job[3])
+                os.remove(job[3])
+            print(f"[{i + 1}/{len(jobs)}] {case_id}: {summary_line(summary)}")
+
+    if combined is not None:
+        combined.close()
+    if scratch is not None:
+        scratch.cleanup()
+    elapsed = time.perf_counter() - start
+    print(f"Готово за {elapsed:.1f} с ({elapsed / len(jobs):.2f} с на случай)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""Пакетная сегментация NIfTI без графического интерфейса.
+
+Пример:
+    python batch_segment.py /data/BraTS2020_ValidationData -o /data/segmentations --batch-size 32 --workers 4
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import BACKENDS
+from constants import IMG_SIZE
+from inference import BATCH_SIZE, MAX_TTA, TILE_BATCH_SIZE, model_input_size, predict_labels, predict_labels_tiled
+from model_loader import get_loader
+from study import NIFTI_EXTENSIONS, Study, group_case_files, strip_nifti_extension
+from volume_io import DEFAULT_COMPRESSLEVEL, save_labels
+
+MODALITIES = ("flair", "t1ce")
+
+
+def find_cases(paths):
+    # Каталог с подкаталогами BraTS (*_flair.nii, *_t1ce.nii), сам каталог случая
+    # или отдельные файлы NIfTI; для каждого случая - список файлов по каналам.
+    # Каналы случая - файлы с общим префиксом, так что каталог с несколькими
+    # случаями даёт по случаю на префикс, а не смесь каналов разных пациентов
+    cases = []
+    for path in paths:
+        if os.path.isfile(path):
+            cases.append((strip_nifti_extension(path), [path]))
+            continue
+        case_dirs = [path] + sorted(e.path for e in os.scandir(path) if e.is_dir())
+        for case_dir in case_dirs:
+            groups = group_case_files(case_dir)
+            for prefix, files in groups.items():
+                if all(m in files for m in MODALITIES):
+                    # Каталог одного случая называется по каталогу
+                    case_id = os.path.basename(os.path.normpath(case_dir)) if len(groups) == 1 else prefix
+                    cases.append((case_id, [files[m] for m in MODALITIES]))
+            if case_dir == path and not any(MODALITIES[0] in files for files in groups.values()):
+                for name in sorted(os.listdir(path)):
+                    full = os.path.join(path, name)
+                    if os.path.isfile(full) and name.endswith(NIFTI_EXTENSIONS):
+                        cases.append((strip_nifti_extension(full), [full]))
+    return cases
+
+
+def load_case(files, n_channels, tiled=False, img_size=IMG_SIZE):
+    # Каналы случая читаются параллельно; первый канал - образец заголовка и affine для результата.
+    # img_size=None - модель с предобработкой в графе, срезы передаются без изменений
+    study = Study(dict(zip(MODALITIES, files))).load()
+    if tiled:
+        # Для тайлов нужны тома в исходном разрешении
+        return study.channel_volumes(n_channels), study.reference
+    return study.model_input(n_channels, img_size), study.reference
+
+
+def output_path_for(output_dir, case_id):
+    return os.path.join(output_dir, f"{case_id}_seg.nii.gz")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная сегментация опухолей мозга")
+    parser.add_argument("inputs", nargs="+", help="каталоги случаев BraTS или файлы NIfTI")
+    parser.add_argument("-o", "--output", required=True, help="каталог для результатов")
+    parser.add_argument("--model", default=None, help="путь к модели .keras/.tflite/.onnx (по умолчанию BT_MODEL_PATH)")
+    parser.add_argument("--backend", default=None, choices=BACKENDS, help="бэкенд инференса (по умолчанию по расширению модели)")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help=f"срезов (или тайлов с --tiles) в одном вызове модели, по умолчанию {BATCH_SIZE} ({TILE_BATCH_SIZE})")
+    parser.add_argument("--tiles", action="store_true",
+                        help="перекрывающиеся тайлы в исходном разрешении вместо сжатия срезов")
+    parser.add_argument("--tta", type=int, default=1, choices=range(1, MAX_TTA + 1), metavar=f"1-{MAX_TTA}",
+                        help="вариантов test-time augmentation в одном вызове модели (отражения, затем повороты)")
+    parser.add_argument("--workers", type=int, default=2, help="потоков для чтения и записи файлов")
+    parser.add_argument("--compresslevel", type=int, default=DEFAULT_COMPRESSLEVEL, choices=range(1, 10),
+                        metavar="1-9", help=f"уровень gzip для результатов, по умолчанию {DEFAULT_COMPRESSLEVEL}")
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="пересчитывать случаи, для которых результат уже есть")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    cases = find_cases(args.inputs)
+    if args.resume:
+        pending = [c for c in cases if not os.path.exists(output_path_for(args.output, c[0]))]
+        print(f"Найдено случаев: {len(cases)}, уже готово: {len(cases) - len(pending)}")
+        cases = pending
+    else:
+        print(f"Найдено случаев: {len(cases)}")
+    if not cases:
+        return 0
+
+    model = get_loader(args.model, args.backend).get()
+    n_channels = model.input_shape[-1]
+    img_size = model_input_size(model)
+    batch_size = args.batch_size or (TILE_BATCH_SIZE if args.tiles else BATCH_SIZE)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        # Чтение следующих случаев идёт параллельно с инференсом текущего
+        loads = [pool.submit(load_case, files, n_channels, args.tiles, img_size) for _, files in cases[:args.workers]]
+        saves = []
+        for i, (case_id, files) in enumerate(cases):
+            if i + args.workers < len(cases):
+                loads.append(pool.submit(load_case, cases[i + args.workers][1], n_channels, args.tiles, img_size))
+            start = time.perf_counter()
+            try:
+                X, reference = loads[i].result()
+                loads[i] = None
+                if args.tiles:
+                    labels = predict_labels_tiled(model, X, n_channels, batch_size, tta=args.tta)
+                else:
+                    labels = predict_labels(model, X, batch_size, args.tta)
+            except Exception as e:
+                failed += 1
+                print(f"[{i + 1}/{len(cases)}] {case_id}: ошибка: {e}", file=sys.stderr)
+                continue
+            output_path = output_path_for(args.output, case_id)
+            # Заголовок и аффинная матрица берутся из первого канала случая; запись идёт
+            # через временный файл, так что недописанный результат не считается готовым при --resume
+            saves.append((case_id, pool.submit(save_labels, labels, output_path, reference, args.compresslevel)))
+            print(f"[{i + 1}/{len(cases)}] {case_id}: {time.perf_counter() - start:.1f} с")
+
+        for case_id, future in saves:
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{case_id}: ошибка записи: {e}", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
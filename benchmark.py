@@ -0,0 +1,303 @@
+"""Замеры этапов конвейера на синтетических и реальных томах.
+
+Примеры:
+    python benchmark.py -o bench.json
+    python benchmark.py --shape 240 240 155 --repeat 5 --model my_model.tflite -o bench.json --compare baseline.json
+    python benchmark.py --real /data/BraTS2021/BraTS2021_00000 --stages decode preprocess predict
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from backends import BACKENDS
+from batch_segment import MODALITIES, find_cases
+from constants import IMG_SIZE, SEGMENT_CLASSES
+from inference import BATCH_SIZE, VolumeReducer, iter_probability_batches, model_input_size
+from model_loader import MODEL_PATH, get_loader
+from preprocessing import allocate_input, copy_slices, normalize_and_resize
+from report import generate_pdf_report
+from slice_cache import render_rgba, volume_slice
+from volume_io import load_volume
+from volume_render import THR_MAX, THR_MIN, build_lods, prepare_rgba
+
+STAGES = ("decode", "preprocess", "predict", "argmax", "slice_render", "volume_prep", "pdf")
+DEFAULT_SHAPE = (240, 240, 155)
+RESULTS_VERSION = 1
+
+
+def synthetic_volume(shape, dtype=np.int16, seed=0):
+    # Эллипсоид "мозга" с шумом и яркое пятно "опухоли"; содержимое влияет только
+    # на сжатие и пороги, поэтому достаточно грубого подобия МРТ
+    rng = np.random.default_rng(seed)
+    x, y, z = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    c = [(s - 1) / 2 for s in shape]
+    r = ((x - c[0]) / (0.4 * shape[0])) ** 2 + ((y - c[1]) / (0.45 * shape[1])) ** 2 + ((z - c[2]) / (0.45 * shape[2])) ** 2
+    tumor = ((x - c[0] * 1.2) / (0.1 * shape[0])) ** 2 + ((y - c[1]) / (0.1 * shape[1])) ** 2 + ((z - c[2]) / (0.1 * shape[2])) ** 2
+    data = np.where(r < 1, 400 + 150 * rng.standard_normal(shape, dtype=np.float32), 0)
+    data[tumor < 1] += 800
+    return np.clip(data, 0, None).astype(dtype)
+
+
+def write_synthetic_case(directory, shape, dtype, n_channels, compress=False):
+    ext = ".nii.gz" if compress else ".nii"
+    files = []
+    for channel, modality in enumerate(MODALITIES[:n_channels]):
+        path = os.path.join(directory, f"synthetic_{modality}{ext}")
+        nib.save(nib.Nifti1Image(synthetic_volume(shape, dtype, seed=channel), np.eye(4)), path)
+        files.append(path)
+    return files
+
+
+def current_rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def reset_peak_rss():
+    # На Linux запись "5" в clear_refs сбрасывает VmHWM до текущего RSS,
+    # так что пик можно мерить для каждого этапа отдельно
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss - пик за всю жизнь процесса (в КБ на Linux, в байтах на macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def measure(name, func, slices, repeat):
+    times = []
+    result = None
+    rss_before = current_rss_mb() if os.path.exists("/proc/self/status") else None
+    per_stage = reset_peak_rss()
+    for _ in range(repeat):
+        result = None
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    record = {
+        "stage": name,
+        "repeat": repeat,
+        "wall_s": median,
+        "wall_min_s": min(times),
+        "slices": slices,
+        "slices_per_s": slices / median if median > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_per_stage": per_stage,
+    }
+    if rss_before is not None and per_stage:
+        record["rss_growth_mb"] = record["peak_rss_mb"] - rss_before
+    print(f"  {name:<13} {median * 1000:9.1f} мс  {record['slices_per_s'] or 0:9.1f} срезов/с  "
+          f"пик RSS {record['peak_rss_mb']:.0f} МБ")
+    return result, record
+
+
+def decode(files):
+    # Чтение целиком: load_volume отображает файл в память лениво
+    return [np.array(load_volume(f).data) for f in files]
+
+
+def preprocess(volumes, n_channels, img_size=IMG_SIZE):
+    # img_size=None - модель с SlicePreprocessing: как в GUI и batch_segment.py, срезы идут
+    # в исходном разрешении, а сжатие и нормализация попадают во время этапа predict
+    if img_size is None:
+        height, width, n_slices = volumes[0].shape[:3]
+        X = np.zeros((n_slices, height, width, n_channels), dtype=np.float32)
+        prepare = copy_slices
+    else:
+        X = allocate_input(volumes[0].shape[2], n_channels, img_size)
+        prepare = normalize_and_resize
+    for channel, volume in enumerate(volumes[:n_channels]):
+        prepare(volume, X, channel=channel)
+    return X
+
+
+def predict(model, X, batch_size):
+    probs = None
+    for start, stop, batch in iter_probability_batches(model, X, batch_size):
+        if probs is None:
+            probs = np.empty((X.shape[0],) + batch.shape[1:], dtype=batch.dtype)
+        probs[start:stop] = batch
+    return probs
+
+
+def argmax(probs):
+    reducer = VolumeReducer(probs.shape[:3])
+    reducer.add(0, probs.shape[0], probs)
+    return reducer.result()[0]
+
+
+def synthetic_probabilities(n_slices, seed=0):
+    rng = np.random.default_rng(seed)
+    logits = rng.standard_normal((n_slices, IMG_SIZE, IMG_SIZE, len(SEGMENT_CLASSES)), dtype=np.float32)
+    # softmax, как на выходе модели
+    probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return probs / probs.sum(axis=-1, keepdims=True)
+
+
+def render_all_slices(volume):
+    # Как при полном проходе слайдерами по трём видам SliceView
+    for axis in range(3):
+        for index in range(volume.shape[axis]):
+            render_rgba(volume_slice(volume, axis, index).T)
+
+
+def volume_prep(volume):
+    return build_lods(prepare_rgba(volume, THR_MIN, THR_MAX))
+
+
+def run_case(name, files, stages, model, n_channels, batch_size, repeat, workdir):
+    print(f"{name}:")
+    records = []
+    volumes = decode(files)
+    shape = volumes[0].shape
+    n_slices = shape[2]
+
+    if "decode" in stages:
+        volumes, record = measure("decode", lambda: decode(files), n_slices * len(files), repeat)
+        records.append(record)
+    img_size = model_input_size(model) if model is not None else IMG_SIZE
+    X = preprocess(volumes, n_channels, img_size)
+    if "preprocess" in stages:
+        X, record = measure("preprocess", lambda: preprocess(volumes, n_channels, img_size), n_slices, repeat)
+        records.append(record)
+
+    probs = None
+    if "predict" in stages:
+        if model is None:
+            records.append({"stage": "predict", "skipped": "модель не задана"})
+            print("  predict       пропущен: модель не задана")
+        else:
+            probs, record = measure("predict", lambda: predict(model, X, batch_size), n_slices, repeat)
+            records.append(record)
+    if "argmax" in stages:
+        if probs is None:
+            probs = synthetic_probabilities(n_slices)
+        records.append(measure("argmax", lambda: argmax(probs), n_slices, repeat)[1])
+        probs = None
+
+    if "slice_render" in stages:
+        records.append(measure("slice_render", lambda: render_all_slices(volumes[0]), sum(shape), repeat)[1])
+    if "volume_prep" in stages:
+        records.append(measure("volume_prep", lambda: volume_prep(volumes[0]), shape[0] // 2, repeat)[1])
+    if "pdf" in stages:
+        pdf_path = os.path.join(workdir, f"{name}.pdf")
+        records.append(measure("pdf", lambda: generate_pdf_report(pdf_path, volumes[0]), 3, repeat)[1])
+
+    return {"name": name, "shape": list(shape), "dtype": str(volumes[0].dtype), "files": len(files), "stages": records}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = {(case["name"], s["stage"]): s for case in baseline["cases"] for s in case["stages"] if "wall_s" in s}
+    print(f"\nСравнение с {baseline_path} ({baseline['environment'].get('revision')}):")
+    for case in results["cases"]:
+        for stage in case["stages"]:
+            before = old.get((case["name"], stage["stage"]))
+            if before is None or "wall_s" not in stage:
+                continue
+            ratio = before["wall_s"] / stage["wall_s"] if stage["wall_s"] > 0 else float("inf")
+            print(f"  {case['name']}/{stage['stage']:<13} {before['wall_s'] * 1000:9.1f} -> "
+                  f"{stage['wall_s'] * 1000:9.1f} мс  x{ratio:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры этапов конвейера сегментации")
+    parser.add_argument("--shape", type=int, nargs=3, default=DEFAULT_SHAPE, metavar=("X", "Y", "Z"),
+                        help="размер синтетического тома")
+    parser.add_argument("--dtype", default="int16", help="тип данных синтетического тома")
+    parser.add_argument("--compress", action="store_true", help="синтетические тома в .nii.gz")
+    parser.add_argument("--no-synthetic", dest="synthetic", action="store_false",
+                        help="мерить только тома из --real")
+    parser.add_argument("--real", nargs="+", default=[], help="каталоги случаев BraTS или файлы NIfTI")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="какие этапы мерить")
+    parser.add_argument("--model", default=None,
+                        help="модель для этапа predict (по умолчанию BT_MODEL_PATH, если файл существует)")
+    parser.add_argument("--backend", default=None, choices=BACKENDS, help="бэкенд инференса")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="срезов в одном вызове модели")
+    parser.add_argument("--channels", type=int, default=None, help="число каналов входа без модели")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов каждого этапа (берётся медиана)")
+    parser.add_argument("-o", "--output", default=None, help="файл JSON с результатами")
+    parser.add_argument("--compare", default=None, help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args(argv)
+
+    model = None
+    model_record = None
+    model_path = args.model or (MODEL_PATH if os.path.exists(MODEL_PATH) else None)
+    if "predict" in args.stages and model_path:
+        loader = get_loader(model_path, args.backend)
+        model = loader.get()
+        model_record = {"path": loader.path, "backend": loader.backend, "load_s": loader.load_time}
+    n_channels = model.input_shape[-1] if model is not None else (args.channels or len(MODALITIES))
+
+    results = {"version": RESULTS_VERSION, "environment": environment(), "args": vars(args),
+               "model": model_record, "cases": []}
+    with tempfile.TemporaryDirectory(prefix="bt-bench-") as workdir:
+        cases = []
+        if args.synthetic:
+            shape = tuple(args.shape)
+            files = write_synthetic_case(workdir, shape, np.dtype(args.dtype), n_channels, args.compress)
+            cases.append(("synthetic_" + "x".join(map(str, shape)), files))
+        cases += find_cases(args.real)
+        for name, files in cases:
+            results["cases"].append(
+                run_case(name, files, args.stages, model, n_channels, args.batch_size, args.repeat, workdir))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1, ensure_ascii=False)
+        print(f"Результаты записаны в {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
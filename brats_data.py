@@ -0,0 +1,32 @@
+"""Чтение случаев BraTS для обучения (без зависимостей от TensorFlow)."""
+
+import os
+
+import nibabel as nib
+import numpy as np
+
+from constants import VOLUME_SLICES, VOLUME_START_AT
+
+TRAINING_MODALITIES = ("flair", "t1ce")
+
+
+def case_file(dataset_path, case_id, modality):
+    return os.path.join(dataset_path, case_id, f'{case_id}_{modality}.nii')
+
+
+def read_slices(path, start=VOLUME_START_AT, count=VOLUME_SLICES):
+    # Через dataobj читаются только нужные срезы и без копии в float64
+    return np.asarray(nib.load(path).dataobj[:, :, start:start + count])
+
+
+def load_training_case(dataset_path, case_id, with_seg=True):
+    # Срезы (срезы, H, W, каналы) в исходном разрешении и типе данных: сжатие и нормализацию
+    # делает сама модель (model_preprocessing.SlicePreprocessing), так же, как при инференсе
+    X = np.stack([read_slices(case_file(dataset_path, case_id, m)) for m in TRAINING_MODALITIES], axis=-1)
+    X = np.ascontiguousarray(np.moveaxis(X, 2, 0))
+
+    if not with_seg:
+        return X, None
+    seg = read_slices(case_file(dataset_path, case_id, 'seg')).astype(np.uint8)
+    seg[seg == 4] = 3
+    return X, np.moveaxis(seg, -1, 0)
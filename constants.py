@@ -0,0 +1,17 @@
+SEGMENT_CLASSES = {
+    0 : 'НЕТ ОПУХОЛИ',
+    1 : 'НЕКРОТИЧЕСКИЙ/ЯДРО',
+    2 : 'ЭДЕМА (ОТЁК)',
+    3 : 'РАСПРОСТРАНЕНИЕ'
+}
+
+VOLUME_SLICES = 100
+VOLUME_START_AT = 22
+IMG_SIZE=128
+
+# Цвета классов (RGBA, 0..1) в 3D-виде, на срезах отчёта и в интерфейсе
+CLASS_COLORS = {
+    1: (0.90, 0.25, 0.25, 1.0),  # некротическое ядро
+    2: (0.35, 0.80, 0.35, 0.45),  # отёк
+    3: (0.95, 0.85, 0.25, 1.0),  # активная опухоль
+}
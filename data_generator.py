@@ -0,0 +1,108 @@
+"""DataGenerator для обучения с чтением случаев в пуле процессов и предвыборкой пакетов."""
+
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import keras
+import numpy as np
+import tensorflow as tf
+
+from brats_data import load_training_case
+from constants import IMG_SIZE
+from preprocess_cache import PreprocessCache, load_entry
+
+
+class DataGenerator(keras.utils.Sequence):
+    def __init__(self, list_IDs, dataset_path, dim=(IMG_SIZE,IMG_SIZE), batch_size = 1, n_channels = 2, shuffle=True,
+                 workers=4, use_multiprocessing=True, max_queue_size=8, cache_dir=None):
+        super().__init__()
+        self.dim = dim
+        self.batch_size = batch_size
+        self.list_IDs = list_IDs
+        self.dataset_path = dataset_path
+        self.n_channels = n_channels
+        self.shuffle = shuffle
+        self.cache = PreprocessCache(cache_dir) if cache_dir else None
+        # Свои имена, чтобы не включать параллельную выдачу пакетов самого Keras:
+        # предвыборка здесь уже ограничена очередью prefetch_depth
+        self.prefetch_workers = workers
+        self.prefetch_processes = use_multiprocessing
+        self.prefetch_depth = max_queue_size
+        self._executor = None
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.floor(len(self.list_IDs) / self.batch_size))
+
+    def __getitem__(self, index):
+        with self._lock:
+            self._prefetch(index)
+            futures = self._pending.pop(index)
+        cases = [f.result() for f in futures]
+        if self.cache is not None:
+            cases = [load_entry(entry) for entry in cases]
+        X, y = self.__data_generation(cases)
+        return X, y
+
+    def on_epoch_end(self):
+        self.indexes = np.arange(len(self.list_IDs))
+        if self.shuffle == True:
+            np.random.shuffle(self.indexes)
+        # После перемешивания заранее прочитанные пакеты уже не соответствуют индексам
+        with self._lock:
+            self._drop_pending(lambda index: True)
+
+    def close(self):
+        with self._lock:
+            self._drop_pending(lambda index: True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            if self.prefetch_processes:
+                # spawn: рабочим процессам не нужен TensorFlow из родителя
+                self._executor = ProcessPoolExecutor(self.prefetch_workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(self.prefetch_workers)
+        return self._executor
+
+    def _batch_ids(self, index):
+        indexes = self.indexes[index*self.batch_size:(index+1)*self.batch_size]
+        return [self.list_IDs[k] for k in indexes]
+
+    def _drop_pending(self, predicate):
+        for index in [i for i in self._pending if predicate(i)]:
+            for future in self._pending.pop(index):
+                future.cancel()
+
+    def _prefetch(self, index):
+        # Очередь ограничена prefetch_depth пакетами, начиная с запрошенного
+        last = min(index + self.prefetch_depth, len(self))
+        self._drop_pending(lambda i: i < index or i >= last)
+        for i in range(index, last):
+            if i not in self._pending:
+                self._pending[i] = [self._pool().submit(self._load_case, self.dataset_path, case_id)
+                                    for case_id in self._batch_ids(i)]
+
+    @property
+    def _load_case(self):
+        # С кэшем рабочие процессы только досоздают записи, а массивы читаются через mmap здесь
+        return self.cache.ensure if self.cache is not None else load_training_case
+
+    def __data_generation(self, cases):
+        X = np.concatenate([x for x, _ in cases]).astype(np.float32, copy=False)
+        y = np.concatenate([seg for _, seg in cases])
+
+        # Сжатие и нормализация срезов - слой модели (model_preprocessing), здесь только маски
+        mask = tf.one_hot(y, 4)
+        Y = tf.image.resize(mask, self.dim)
+        return X, Y
+
+    def __del__(self):
+        self.close()
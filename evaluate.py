@@ -0,0 +1,235 @@
+"""Оценка модели по случаям BraTS: Dice и HD95 для областей WT/TC/ET, таблица CSV или JSON.
+
+Примеры:
+    python evaluate.py /data/BraTS2021 --ids test_ids.txt -o test.csv
+    python evaluate.py /data/BraTS2021 --model my_model_fp16.tflite --tiles -o test.json
+    python evaluate.py /data/BraTS2021 --predictions /data/segmentations -o test.csv
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from scipy import ndimage
+
+from backends import BACKENDS
+from batch_report import find_labels, iter_results
+from batch_segment import MODALITIES, find_cases, load_case
+from inference import BATCH_SIZE, MAX_TTA, TILE_BATCH_SIZE, model_input_size, predict_labels, predict_labels_tiled
+from model_loader import get_loader
+from study import study_files
+from volume_io import load_volume
+
+# Области BraTS в метках модели (исходная метка 4 - класс 3): вся опухоль,
+# ядро опухоли и активная опухоль
+REGIONS = {"WT": (1, 2, 3), "TC": (1, 3), "ET": (3,)}
+COLUMNS = ["case"] + [f"dice_{r}" for r in REGIONS] + [f"hd95_{r}" for r in REGIONS]
+
+
+def ground_truth(path):
+    truth = load_volume(path)
+    labels = np.asarray(truth.data, dtype=np.uint8)
+    labels[labels == 4] = 3
+    return labels, tuple(float(z) for z in truth.header.get_zooms()[:3])
+
+
+def upsample_labels(labels, shape):
+    # Метки выхода модели (IMG_SIZE x IMG_SIZE) -> разрешение разметки ближайшим соседом
+    if labels.shape == tuple(shape):
+        return labels
+    rows = np.minimum((np.arange(shape[0]) + 0.5) * labels.shape[0] / shape[0], labels.shape[0] - 1).astype(np.intp)
+    cols = np.minimum((np.arange(shape[1]) + 0.5) * labels.shape[1] / shape[1], labels.shape[1] - 1).astype(np.intp)
+    return labels[rows[:, np.newaxis], cols]
+
+
+def dice(pred, truth):
+    total = pred.sum() + truth.sum()
+    # Область отсутствует в обеих разметках - полное совпадение
+    return 1.0 if total == 0 else 2.0 * np.logical_and(pred, truth).sum() / total
+
+
+def surface(mask):
+    return mask & ~ndimage.binary_erosion(mask)
+
+
+def hausdorff95(pred, truth, spacing):
+    # 95-й перцентиль расстояний между поверхностями (мм) через преобразование расстояний,
+    # без попарных расстояний между точками. Пустая область в обеих разметках - 0,
+    # только в одной - расстояние не определено
+    if not pred.any() and not truth.any():
+        return 0.0
+    if not pred.any() or not truth.any():
+        return float("nan")
+    # Расстояния между поверхностями не меняются при обрезке до общей рамки масок
+    # (с запасом в воксель для эрозии), а преобразование на рамке в разы дешевле
+    box = ndimage.find_objects((pred | truth).astype(np.uint8))[0]
+    box = tuple(slice(max(s.start - 1, 0), s.stop + 1) for s in box)
+    pred_surface = surface(pred[box])
+    truth_surface = surface(truth[box])
+    to_truth = ndimage.distance_transform_edt(~truth_surface, sampling=spacing)
+    to_pred = ndimage.distance_transform_edt(~pred_surface, sampling=spacing)
+    distances = np.concatenate([to_truth[pred_surface], to_pred[truth_surface]])
+    return float(np.percentile(distances, 95))
+
+
+def evaluate_case(case_id, prediction, truth_path):
+    # Выполняется в рабочем процессе: разметка читается здесь, предсказание приходит
+    # массивом (после инференса) или путём к файлу (--predictions)
+    truth, spacing = ground_truth(truth_path)
+    if isinstance(prediction, str):
+        prediction = np.asarray(load_volume(prediction).data, dtype=np.uint8)
+    labels = upsample_labels(prediction, truth.shape)
+    row = {"case": case_id}
+    for region, classes in REGIONS.items():
+        pred = np.isin(labels, classes)
+        true = np.isin(truth, classes)
+        row[f"dice_{region}"] = dice(pred, true)
+        row[f"hd95_{region}"] = hausdorff95(pred, true, spacing)
+    return row
+
+
+def iter_predicted_jobs(cases, model, batch_size, tiled, tta, workers, errors):
+    # Инференс один раз на случай в основном процессе; чтение следующих случаев идёт
+    # параллельно, а метрики уже готовых считаются в пуле процессов
+    n_channels = model.input_shape[-1]
+    img_size = model_input_size(model)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        loads = [pool.submit(load_case, files, n_channels, tiled, img_size) for _, files, _ in cases[:workers]]
+        for i, (case_id, files, truth_path) in enumerate(cases):
+            if i + workers < len(cases):
+                loads.append(pool.submit(load_case, cases[i + workers][1], n_channels, tiled, img_size))
+            try:
+                X = loads[i].result()[0]
+                loads[i] = None
+                if tiled:
+                    labels = predict_labels_tiled(model, X, n_channels, batch_size, tta=tta)
+                else:
+                    labels = predict_labels(model, X, batch_size, tta)
+            except Exception as e:
+                errors.append((case_id, e))
+                continue
+            yield case_id, labels, truth_path
+
+
+def read_ids(path):
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def summarize(rows):
+    summary = {}
+    for column in COLUMNS[1:]:
+        values = np.array([row[column] for row in rows], dtype=np.float64)
+        finite = values[np.isfinite(values)]
+        summary[column] = {
+            "mean": float(finite.mean()) if finite.size else None,
+            "median": float(np.median(finite)) if finite.size else None,
+            "undefined": int(values.size - finite.size),
+        }
+    return summary
+
+
+def json_value(value):
+    return None if isinstance(value, float) and not np.isfinite(value) else value
+
+
+def write_results(path, rows, summary):
+    if path.lower().endswith(".json"):
+        with open(path, "w") as f:
+            json.dump({"cases": [{k: json_value(v) for k, v in row.items()} for row in rows],
+                       "summary": summary}, f, indent=1)
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: "" if json_value(v) is None else v for k, v in row.items()})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Оценка сегментации опухолей мозга по случаям BraTS")
+    parser.add_argument("inputs", nargs="+", help="каталоги случаев BraTS с разметкой *_seg.nii")
+    parser.add_argument("-o", "--output", required=True, help="таблица результатов .csv или .json")
+    parser.add_argument("--ids", default=None, help="файл со списком случаев (по одному в строке), например тестовая выборка")
+    parser.add_argument("--cases", type=int, default=None, help="ограничить число случаев")
+    parser.add_argument("--predictions", default=None,
+                        help="каталог с готовыми <case>_seg.nii.gz (batch_segment.py) вместо инференса")
+    parser.add_argument("--model", default=None, help="путь к модели .keras/.tflite/.onnx (по умолчанию BT_MODEL_PATH)")
+    parser.add_argument("--backend", default=None, choices=BACKENDS, help="бэкенд инференса (по умолчанию по расширению модели)")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help=f"срезов (или тайлов с --tiles) в одном вызове модели, по умолчанию {BATCH_SIZE} ({TILE_BATCH_SIZE})")
+    parser.add_argument("--tiles", action="store_true",
+                        help="перекрывающиеся тайлы в исходном разрешении вместо сжатия срезов")
+    parser.add_argument("--tta", type=int, default=1, choices=range(1, MAX_TTA + 1), metavar=f"1-{MAX_TTA}",
+                        help="вариантов test-time augmentation в одном вызове модели (отражения, затем повороты)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов для расчёта метрик")
+    parser.add_argument("--io-workers", type=int, default=2, help="потоков для чтения случаев")
+    args = parser.parse_args(argv)
+
+    ids = read_ids(args.ids) if args.ids else None
+    cases, missing = [], []
+    for case_id, files in find_cases(args.inputs):
+        if ids is not None and case_id not in ids:
+            continue
+        # Оцениваются только полные случаи BraTS с разметкой
+        truth_path = study_files(files[0]).get("seg") if len(files) == len(MODALITIES) else None
+        if truth_path is None:
+            missing.append(case_id)
+        else:
+            cases.append((case_id, files, truth_path))
+    cases = cases[:args.cases]
+    print(f"Найдено случаев: {len(cases)}, без разметки: {len(missing)}")
+    if not cases:
+        return 1
+
+    errors = []
+    if args.predictions:
+        jobs = []
+        for case_id, files, truth_path in cases:
+            prediction = find_labels(case_id, files, args.predictions)
+            if prediction is None:
+                errors.append((case_id, "нет предсказания"))
+            else:
+                jobs.append((case_id, prediction, truth_path))
+    else:
+        model = get_loader(args.model, args.backend).get()
+        batch_size = args.batch_size or (TILE_BATCH_SIZE if args.tiles else BATCH_SIZE)
+        jobs = iter_predicted_jobs(cases, model, batch_size, args.tiles, args.tta, args.io_workers, errors)
+
+    rows = []
+    start = time.perf_counter()
+    # spawn: рабочим процессам не нужны TensorFlow и модель из родителя
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for job, row, error in iter_results(pool, evaluate_case, jobs, 2 * args.workers):
+            if error is not None:
+                errors.append((job[0], error))
+                continue
+            rows.append(row)
+            print(f"[{len(rows)}/{len(cases)}] {job[0]}: " +
+                  ", ".join(f"{r} {row[f'dice_{r}']:.3f}/{row[f'hd95_{r}']:.1f} мм" for r in REGIONS))
+
+    for case_id, error in errors:
+        print(f"{case_id}: ошибка: {error}", file=sys.stderr)
+    if not rows:
+        return 1
+    summary = summarize(rows)
+    write_results(args.output, rows, summary)
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{'область':<8} {'Dice':>8} {'HD95, мм':>10} {'HD95 не опр.':>13}")
+    for region in REGIONS:
+        d, h = summary[f"dice_{region}"], summary[f"hd95_{region}"]
+        hd95 = f"{h['mean']:.2f}" if h["mean"] is not None else "—"
+        print(f"{region:<8} {d['mean']:>8.4f} {hd95:>10} {h['undefined']:>13}")
+    print(f"Готово за {elapsed:.1f} с ({elapsed / len(rows):.2f} с на случай), результаты: {args.output}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Экспорт модели Keras в TFLite/ONNX для CPU и проверка совпадения сегментации.
+
+Примеры:
+    python export_model.py export --model my_model.keras -o my_model_int8.tflite --quantize int8 --calibration /data/BraTS2021
+    python export_model.py export --model my_model.keras -o my_model.onnx --check /data/BraTS2021
+    python export_model.py check --model my_model.keras --candidate my_model_fp16.tflite /data/BraTS2021
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import nibabel as nib
+import numpy as np
+
+from backends import backend_for_path, load_backend
+from batch_segment import MODALITIES, find_cases, load_case
+from constants import IMG_SIZE, SEGMENT_CLASSES
+from inference import BATCH_SIZE, model_input_size, predict_labels
+from model_loader import MODEL_PATH
+from study import Study, study_files
+
+QUANTIZATION = ("none", "float16", "int8")
+CALIBRATION_CASES = 4
+CALIBRATION_SLICES = 200
+ONNX_OPSET = 13
+
+
+def representative_slices(case_dirs, n_channels, img_size=IMG_SIZE, max_cases=CALIBRATION_CASES,
+                          max_slices=CALIBRATION_SLICES):
+    # Срезы для калибровки int8 берутся из нескольких случаев BraTS; пустые
+    # срезы за пределами мозга пропускаются, иначе диапазоны активаций занижены
+    cases = find_cases(case_dirs)[:max_cases]
+    if not cases:
+        raise ValueError("Не найдено случаев для калибровки")
+    per_case = max(1, max_slices // len(cases))
+    for _, files in cases:
+        X = load_case(files, n_channels, img_size=img_size)[0]
+        informative = np.flatnonzero(X.reshape(X.shape[0], -1).max(axis=1) > 0)
+        step = max(1, len(informative) // per_case)
+        for index in informative[::step][:per_case]:
+            yield X[index:index + 1]
+
+
+def export_tflite(model, output_path, quantize="none", calibration=()):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == "int8":
+        n_channels = model.input_shape[-1]
+        img_size = model_input_size(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([x] for x in representative_slices(calibration, n_channels,
+                                                                                      img_size))
+        # Веса и активации в int8, вход и выход остаются float32, поэтому
+        # предобработка и argmax не меняются
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, output_path, quantize="none"):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name="input")]
+    onnx_model, _ = tf2onnx.convert.from_keras(model, input_signature=spec, opset=ONNX_OPSET)
+    if quantize == "float16":
+        from onnxconverter_common import float16
+        # Вход и выход остаются float32, как у остальных бэкендов
+        onnx_model = float16.convert_float_to_float16(onnx_model, keep_io_types=True)
+    with open(output_path, "wb") as f:
+        f.write(onnx_model.SerializeToString())
+
+
+def export_model(model_path, output_path, quantize="none", calibration=()):
+    from tensorflow.keras.models import load_model
+    from model_preprocessing import CUSTOM_OBJECTS, without_preprocessing
+
+    backend = backend_for_path(output_path)
+    if backend == "keras":
+        raise ValueError("Выходной файл должен иметь расширение .tflite или .onnx")
+    if quantize == "int8" and backend != "tflite":
+        raise ValueError("Квантование int8 поддерживается только для TFLite")
+    if quantize == "int8" and not calibration:
+        raise ValueError("Для int8 нужны случаи BraTS для калибровки (--calibration)")
+
+    # Экспортируется U-Net без SlicePreprocessing (ScaleAndTranslate не поддерживают ни TFLite,
+    # ни tf2onnx): вход фиксирован (IMG_SIZE, IMG_SIZE, C), и срезы для неё готовятся в NumPy
+    model = without_preprocessing(load_model(model_path, custom_objects=CUSTOM_OBJECTS, compile=False))
+    if backend == "tflite":
+        export_tflite(model, output_path, quantize, calibration)
+    else:
+        export_onnx(model, output_path, quantize)
+
+
+def dice(a, b):
+    total = a.sum() + b.sum()
+    # Класс отсутствует в обеих разметках - полное совпадение
+    return 1.0 if total == 0 else 2.0 * np.logical_and(a, b).sum() / total
+
+
+def class_dice(labels, reference):
+    return {cls: dice(labels == cls, reference == cls) for cls in SEGMENT_CLASSES if cls != 0}
+
+
+def ground_truth(image_path, shape):
+    # Разметка BraTS того же случая (класс 4 -> 3), сжатая до разрешения выхода модели ближайшим соседом
+    path = study_files(image_path).get("seg")
+    if path is None:
+        return None
+    seg = np.asarray(nib.load(path).dataobj, dtype=np.uint8)
+    seg[seg == 4] = 3
+    return cv2.resize(seg, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST).reshape(shape)
+
+
+def timed_labels(model, X, batch_size):
+    start = time.perf_counter()
+    labels = predict_labels(model, X, batch_size)
+    return labels, time.perf_counter() - start
+
+
+def check_parity(reference_path, candidate_path, case_dirs, max_cases=None, batch_size=BATCH_SIZE):
+    reference = load_backend(reference_path)
+    candidate = load_backend(candidate_path)
+    n_channels = reference.input_shape[-1]
+    cases = find_cases(case_dirs)[:max_cases]
+    if not cases:
+        raise ValueError("Не найдено случаев для проверки")
+    # Модели могут ждать разный вход: Keras с SlicePreprocessing - срезы в исходном разрешении,
+    # экспортированная U-Net - сжатые и нормированные в NumPy. Так проверяется и сам экспорт,
+    # и совпадение предобработки в графе с NumPy
+    sizes = [model_input_size(reference), model_input_size(candidate)]
+    # Первый вызов каждого бэкенда не учитывается во времени
+    for model, size in zip((reference, candidate), sizes):
+        model.predict_on_batch(np.zeros((1, size or IMG_SIZE, size or IMG_SIZE, n_channels), dtype=np.float32))
+
+    classes = [cls for cls in SEGMENT_CLASSES if cls != 0]
+    agreement = {cls: [] for cls in classes}
+    truth_delta = {cls: [] for cls in classes}
+    times = [0.0, 0.0]
+    slices = 0
+    for case_id, files in cases:
+        study = Study(dict(zip(MODALITIES, files))).load()
+        inputs = {size: study.model_input(n_channels, size) for size in set(sizes)}
+        X = inputs[sizes[0]]
+        ref_labels, ref_time = timed_labels(reference, X, batch_size)
+        cand_labels, cand_time = timed_labels(candidate, inputs[sizes[1]], batch_size)
+        times[0] += ref_time
+        times[1] += cand_time
+        slices += X.shape[0]
+
+        scores = class_dice(cand_labels, ref_labels)
+        line = ", ".join(f"{SEGMENT_CLASSES[cls]} {scores[cls]:.4f}" for cls in classes)
+        for cls in classes:
+            agreement[cls].append(scores[cls])
+        truth = ground_truth(files[0], ref_labels.shape)
+        if truth is not None:
+            ref_scores = class_dice(ref_labels, truth)
+            cand_scores = class_dice(cand_labels, truth)
+            for cls in classes:
+                truth_delta[cls].append(cand_scores[cls] - ref_scores[cls])
+        print(f"{case_id}: совпадение Dice: {line}")
+
+    print(f"\nСлучаев: {len(cases)}, срезов: {slices}")
+    print(f"{'класс':<20} {'Dice с эталоном':>16} {'мин.':>8} {'ΔDice с разметкой':>18}")
+    for cls in classes:
+        delta = f"{np.mean(truth_delta[cls]):+.4f}" if truth_delta[cls] else "—"
+        print(f"{SEGMENT_CLASSES[cls]:<20} {np.mean(agreement[cls]):>16.4f} {np.min(agreement[cls]):>8.4f} {delta:>18}")
+    print(f"{os.path.basename(reference_path)}: {slices / times[0]:.1f} срезов/с, {os.path.basename(candidate_path)}: "
+          f"{slices / times[1]:.1f} срезов/с (x{times[0] / times[1]:.2f})")
+    return agreement, truth_delta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Экспорт модели сегментации для инференса на CPU")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="конвертировать модель Keras в .tflite или .onnx")
+    export.add_argument("--model", default=MODEL_PATH, help="модель .keras (по умолчанию BT_MODEL_PATH)")
+    export.add_argument("-o", "--output", required=True, help="выходной файл .tflite или .onnx")
+    export.add_argument("--quantize", choices=QUANTIZATION, default="none", help="квантование весов")
+    export.add_argument("--calibration", nargs="+", default=[], help="каталоги BraTS для калибровки int8")
+    export.add_argument("--check", nargs="+", default=None, help="после экспорта сравнить с Keras на этих случаях")
+    export.add_argument("--cases", type=int, default=None, help="ограничить число случаев для проверки")
+
+    check = commands.add_parser("check", help="сравнить сегментацию экспортированной модели с Keras")
+    check.add_argument("inputs", nargs="+", help="каталоги случаев BraTS или файлы NIfTI")
+    check.add_argument("--model", default=MODEL_PATH, help="эталонная модель .keras (по умолчанию BT_MODEL_PATH)")
+    check.add_argument("--candidate", required=True, help="проверяемая модель .tflite или .onnx")
+    check.add_argument("--cases", type=int, default=None, help="ограничить число случаев")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        start = time.perf_counter()
+        export_model(args.model, args.output, args.quantize, args.calibration)
+        size = os.path.getsize(args.output) / 2 ** 20
+        print(f"{args.output}: {size:.1f} МБ, {time.perf_counter() - start:.1f} с")
+        if args.check:
+            check_parity(args.model, args.output, args.check, args.cases)
+    else:
+        check_parity(args.model, args.candidate, args.inputs, args.cases)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,50 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
-import nibabel as nib
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import pyqtgraph.opengl as gl
 import pyqtgraph as pg
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Image
-import PIL
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-from tensorflow.keras.models import load_model
-import io
 #import cv2
 
 import os
 os.environ['PYOPENGL_PLATFORM'] = 'egl'
-model = load_model('/home/bolgoff/braintumor/my_model.keras', compile=False)
 
-SEGMENT_CLASSES = {
-    0 : 'НЕТ ОПУХОЛИ',
-    1 : 'НЕКРОТИЧЕСКИЙ/ЯДРО',
-    2 : 'ЭДЕМА (ОТЁК)',
-    3 : 'РАСПРОСТРАНЕНИЕ'
-}
+from constants import CLASS_COLORS, SEGMENT_CLASSES, IMG_SIZE
+from backends import BACKENDS
+from inference import MAX_TTA
+from label_meshes import LabelMeshRenderer
+from model_loader import get_loader
+from profiling import overlay_enabled, profiler, timed
+from report import generate_pdf_report
+from segmentation_worker import SegmentationWorker
+from save_worker import SaveWorker
+from slice_view import SliceView
+from tumor_index import TumorIndex
+from study import open_study
+from volume_io import DEFAULT_COMPRESSLEVEL, save_intensities, save_labels
+from volume_render import RENDER_TYPE, THR_MIN, THR_MAX, LodVolume, build_lods, prepare_rgba
+
+NIFTI_GZ_FILTER = "NIfTI, сжатый (*.nii.gz)"
+NIFTI_FILTER = "NIfTI без сжатия (*.nii)"
+COMPRESSION_LEVELS = (
+    ("Сжатие gzip 1 (быстро)", 1),
+    ("Сжатие gzip 6", 6),
+    ("Сжатие gzip 9 (меньше размер)", 9),
+)
+# Число вариантов test-time augmentation: отражения, затем повороты на 90°
+TTA_MODES = (
+    ("Без TTA", 1),
+    ("TTA: 2 варианта", 2),
+    ("TTA: 4 отражения", 4),
+    ("TTA: отражения и повороты", MAX_TTA),
+)
+
+
+class ModelWarmupSignals(QtCore.QObject):
+    loaded = QtCore.pyqtSignal(float)
+    failed = QtCore.pyqtSignal(str)
 
-VOLUME_SLICES = 100
-VOLUME_START_AT = 22
-IMG_SIZE=128
 
 class Ui_MainWindow(object):
-    def setupUi(self, MainWindow):
+    def setupUi(self, MainWindow, model_path=None, model_backend=None):
         MainWindow.setWindowTitle("Сегментация опухоли мозга")
         MainWindow.setObjectName("MainWindow")
         MainWindow.resize(1920, 1080)
@@ -76,6 +91,38 @@ class Ui_MainWindow(object):
         self.top_buttons_layout.addWidget(self.save_image, 1)
         self.top_buttons_layout.addWidget(self.save_report, 1)
 
+        self.tiled_checkbox = QtWidgets.QCheckBox("Полное разрешение (тайлы)")
+        self.tiled_checkbox.setStyleSheet("QCheckBox { color: #D8DEE9; font-size: 18px; }")
+        self.top_buttons_layout.addWidget(self.tiled_checkbox)
+
+        # Варианты TTA идут в модель одним пакетом с исходными срезами: устойчивее, но дольше
+        self.tta_combo = QtWidgets.QComboBox()
+        self.tta_combo.setStyleSheet("QComboBox { color: #D8DEE9; font-size: 18px; }")
+        for text, variants in TTA_MODES:
+            self.tta_combo.addItem(text, variants)
+        self.top_buttons_layout.addWidget(self.tta_combo)
+
+        # Уровень gzip для .nii.gz; файлы .nii пишутся без сжатия
+        self.compression_combo = QtWidgets.QComboBox()
+        self.compression_combo.setStyleSheet("QComboBox { color: #D8DEE9; font-size: 18px; }")
+        for text, level in COMPRESSION_LEVELS:
+            self.compression_combo.addItem(text, level)
+        self.compression_combo.setCurrentIndex(
+            [level for _, level in COMPRESSION_LEVELS].index(DEFAULT_COMPRESSLEVEL))
+        self.top_buttons_layout.addWidget(self.compression_combo)
+
+        # Видимость поверхностей классов в 3D-виде после сегментации
+        self.class_checkboxes = {}
+        for cls in CLASS_COLORS:
+            checkbox = QtWidgets.QCheckBox(SEGMENT_CLASSES[cls])
+            checkbox.setChecked(True)
+            r, g, b, _ = CLASS_COLORS[cls]
+            checkbox.setStyleSheet(
+                f"QCheckBox {{ color: rgb({int(r * 255)}, {int(g * 255)}, {int(b * 255)}); font-size: 18px; }}")
+            checkbox.toggled.connect(lambda checked, cls=cls: self.label_meshes.set_visible(cls, checked))
+            self.top_buttons_layout.addWidget(checkbox)
+            self.class_checkboxes[cls] = checkbox
+
         self.top_buttons_layout.addStretch()
         self.top_buttons_layout.setAlignment(QtCore.Qt.AlignTop)
 
@@ -87,9 +134,9 @@ class Ui_MainWindow(object):
         self.images_widget.setStyleSheet("background-color: #3B4252; border-radius: 10px;")
         self.images_layout = QtWidgets.QGridLayout(self.images_widget)
 
-        self.x_axis = self.create_axis_widget("Осевой срез")
-        self.y_axis = self.create_axis_widget("Коронарный срез")
-        self.z_axis = self.create_axis_widget("Сагиттальный срез")
+        self.x_axis = SliceView("Осевой срез", axis=2)
+        self.y_axis = SliceView("Коронарный срез", axis=1)
+        self.z_axis = SliceView("Сагиттальный срез", axis=0)
 
         self.images_layout.addWidget(self.x_axis, 0, 0)
         self.images_layout.addWidget(self.y_axis, 0, 1)
@@ -101,6 +148,8 @@ class Ui_MainWindow(object):
         self.three_d_view.pan(0, 0, 10)
         
         self.images_layout.addWidget(self.three_d_view, 1, 1)
+        self.lod_volume = None
+        self.label_meshes = LabelMeshRenderer(self.three_d_view)
 
         self.content_layout.addWidget(self.images_widget)
 
@@ -115,6 +164,17 @@ class Ui_MainWindow(object):
         self.statusbar = QtWidgets.QStatusBar(MainWindow)
         self.statusbar.setObjectName("statusbar")
         MainWindow.setStatusBar(self.statusbar)
+
+        # Сводка таймеров операций: последнее/среднее/p95
+        self.profile_label = QtWidgets.QLabel()
+        self.profile_label.setStyleSheet("color: #A3BE8C;")
+        self.statusbar.addPermanentWidget(self.profile_label)
+        self.profile_timer = QtCore.QTimer(MainWindow)
+        self.profile_timer.setInterval(500)
+        self.profile_timer.timeout.connect(self.update_profile_overlay)
+        self.profile_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence("F12"), MainWindow)
+        self.profile_shortcut.activated.connect(self.toggle_profile_overlay)
+        self.set_profile_overlay(overlay_enabled())
         self.menubar.addAction(self.menuFile.menuAction())
 
         self.load_image.clicked.connect(self.load_mri_image)
@@ -123,32 +183,38 @@ class Ui_MainWindow(object):
 
         self.segmentation.clicked.connect(self.run_segmentation)
 
-    def create_axis_widget(self, label_text):
-        widget = QtWidgets.QWidget()
-        layout = QtWidgets.QVBoxLayout(widget)
+        self.model_loader = get_loader(model_path, model_backend)
+        self.model_signals = ModelWarmupSignals()
+        self.model_signals.loaded.connect(self.on_model_loaded)
+        self.model_signals.failed.connect(self.on_model_failed)
 
-        label = QtWidgets.QLabel(label_text)
-        label.setAlignment(QtCore.Qt.AlignCenter)
-        label.setStyleSheet("color: #D8DEE9; font-size: 16px;")
-        layout.addWidget(label)
+    def start_model_warmup(self):
+        if self.model_loader.is_loaded():
+            return
+        self.statusbar.showMessage(f"Загрузка модели {self.model_loader.path} ({self.model_loader.backend})...")
+        self.model_loader.warm_up(
+            on_done=self.model_signals.loaded.emit,
+            on_error=lambda e: self.model_signals.failed.emit(str(e)))
 
-        canvas = FigureCanvas(plt.figure())
-        layout.addWidget(canvas)
+    def on_model_loaded(self, seconds):
+        self.statusbar.showMessage(f"Модель загружена за {seconds:.1f} с")
 
-        slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
-        slider.setMinimum(0)
-        slider.setStyleSheet(
-            "QSlider::groove:horizontal { background: #4C566A; height: 8px; }"
-            "QSlider::handle:horizontal { background: #88C0D0; width: 16px; border-radius: 8px; margin: -4px 0; }"
-        )
-        slider.valueChanged.connect(self.slider_moved)
-        layout.addWidget(slider)
+    def on_model_failed(self, message):
+        self.statusbar.showMessage(f"Ошибка загрузки модели: {message}")
+
+    def set_profile_overlay(self, visible):
+        self.profile_label.setVisible(visible)
+        if visible:
+            self.update_profile_overlay()
+            self.profile_timer.start()
+        else:
+            self.profile_timer.stop()
 
-        widget.slider = slider
-        widget.canvas = canvas
-        widget.slice_data = None
+    def toggle_profile_overlay(self):
+        self.set_profile_overlay(not self.profile_timer.isActive())
 
-        return widget
+    def update_profile_overlay(self):
+        self.profile_label.setText(profiler.summary())
 
     def load_mri_image(self):
         file_dialog = QtWidgets.QFileDialog()
@@ -156,146 +222,113 @@ class Ui_MainWindow(object):
             None, "Выберите файл изображения", "", "NIfTI Files (*.nii *.nii.gz)")
 
         if file_path:
-            global mri_data
-            mri_data = nib.load(file_path).get_fdata()
-            self.display_mri_slices(mri_data)
-            self.display_3d_view(np.squeeze(mri_data))
+            with timed("load_mri_image"):
+                # Вместе с выбранным файлом параллельно читаются остальные модальности случая
+                # (FLAIR и T1CE нужны модели); срезы - в исходном типе данных
+                self.study = open_study(file_path)
+                self.volume = self.study.volume_for(file_path)
+                self.reset_segmentation()
+                self.display_mri_slices(self.volume.data)
+                self.display_3d_view(self.volume.data)
+            self.statusbar.showMessage(f"Модальности: {', '.join(self.study.volumes)}")
+
+    def reset_segmentation(self):
+        # Разметка, индекс опухоли и поверхности классов относятся к прежнему исследованию
+        # и не должны попасть в отчёт или 3D-вид нового
+        self.segmentation_labels = None
+        self.tumor_index = None
+        self.label_meshes.clear()
 
     def display_mri_slices(self, mri_data):
         self.mri_data = mri_data
 
-        axial_middle = mri_data.shape[2] // 2
-        coronal_middle = mri_data.shape[1] // 2
-        sagittal_middle = mri_data.shape[0] // 2
-
-        self.x_axis.slice_data = mri_data
-        self.y_axis.slice_data = mri_data
-        self.z_axis.slice_data = mri_data
-
-        self.x_axis.slider.setMaximum(mri_data.shape[2] - 1)
-        self.y_axis.slider.setMaximum(mri_data.shape[1] - 1)
-        self.z_axis.slider.setMaximum(mri_data.shape[0] - 1)
-
-        self.update_canvas(self.x_axis.canvas, mri_data[:, :, axial_middle])
-        self.update_canvas(self.y_axis.canvas, mri_data[:, coronal_middle, :])
-        self.update_canvas(self.z_axis.canvas, mri_data[sagittal_middle, :, :])
-
-        self.x_axis.slider.setValue(axial_middle)
-        self.y_axis.slider.setValue(coronal_middle)
-        self.z_axis.slider.setValue(sagittal_middle)
-
-    def slider_moved(self):
-        sender = self.centralwidget.sender()
-        if sender == self.x_axis.slider:
-            slice_idx = sender.value()
-            self.update_canvas(self.x_axis.canvas, self.x_axis.slice_data[:, :, slice_idx])
-        elif sender == self.y_axis.slider:
-            slice_idx = sender.value()
-            self.update_canvas(self.y_axis.canvas, self.y_axis.slice_data[:, slice_idx, :])
-        elif sender == self.z_axis.slider:
-            slice_idx = sender.value()
-            self.update_canvas(self.z_axis.canvas, self.z_axis.slice_data[slice_idx, :, :])
-
-    def update_canvas(self, canvas, image_slice):
-        canvas.figure.clear()
-        ax = canvas.figure.add_subplot(111)
-        ax.imshow(image_slice.T, origin="lower", cmap='gray')
-        canvas.draw()
+        self.x_axis.set_volume(mri_data)
+        self.y_axis.set_volume(mri_data)
+        self.z_axis.set_volume(mri_data)
 
-    def display_3d_view(self, mri_data):
-        RENDER_TYPE = "translucent"
-        THR_MIN = 1
-        THR_MAX = 2000
+    def refresh_slices(self):
+        for view in (self.x_axis, self.y_axis, self.z_axis):
+            view.invalidate()
+        self.x_axis.render()
+        self.y_axis.render()
+        self.z_axis.render()
 
+    def clear_3d_view(self):
+        self.label_meshes.clear()
         self.three_d_view.clear()
+        if self.lod_volume is not None:
+            self.lod_volume.detach()
+            self.lod_volume = None
 
-        data = mri_data
-        data[data == 0] = THR_MIN
-        data[data < THR_MIN] = THR_MIN
-        data[data >= THR_MAX] = THR_MAX
-        data -= THR_MIN
-        data /= THR_MAX - THR_MIN
-
-        data = data[:, ::-1, :]
-        half_x = data.shape[0] // 2
-        cropped_data = data[:half_x, :, :]
-        d2 = np.zeros(cropped_data.shape + (4,))
-
-        d2[..., 3] = cropped_data**1 * 255  # прозрачность
-        d2[..., 0] = d2[..., 3]  # красный
-        d2[..., 1] = d2[..., 3]  # зеленый
-        d2[..., 2] = d2[..., 3]  # синий
-        
-        d2[:40, 0, 0] = [255, 0, 0, 255]
-        d2[0, :40, 0] = [0, 255, 0, 255]
-        d2[0, 0, :40] = [0, 0, 255, 255]
-        d2 = d2.astype(np.ubyte)
+    @timed("display_3d_view")
+    def display_3d_view(self, mri_data):
+        self.clear_3d_view()
 
-        volume = gl.GLVolumeItem(d2, sliceDensity=6, smooth=False, glOptions=RENDER_TYPE)
-        volume.translate(dx=-d2.shape[0]/2, dy=-d2.shape[1]/2, dz=-d2.shape[2]/3)
-        self.three_d_view.addItem(volume)
+        # uint8 RGBA без изменения входного тома и уровни детализации для вращения
+        rgba = prepare_rgba(mri_data, THR_MIN, THR_MAX)
+        self.lod_volume = LodVolume(self.three_d_view, build_lods(rgba), RENDER_TYPE)
 
     def save_segmentation(self):
         if not hasattr(self, "mri_data") or self.mri_data is None:
             QtWidgets.QMessageBox.warning(None, "Ошибка", "Нет данных для сохранения!")
             return
+        if getattr(self, "save_worker", None) is not None:
+            return
 
         file_dialog = QtWidgets.QFileDialog()
-        file_path, _ = file_dialog.getSaveFileName(
-            None, "Выберите путь для сохранения", "", "NIfTI Files (*.nii *.nii.gz)")
-
-        if file_path:
-            nifti_image = nib.Nifti1Image(self.mri_data, affine=np.eye(4))
-            try:
-                nib.save(nifti_image, file_path)
-                QtWidgets.QMessageBox.information(None, "Удачно", "Файл успешно сохранён!")
-            except Exception as e:
-                QtWidgets.QMessageBox.critical(None, "Ошибка", f"Ошибка при сохранении: {e}")
-
-    def generate_pdf_report(self, file_path):
-        doc = SimpleDocTemplate(file_path, pagesize=letter)
-        styles = getSampleStyleSheet()
-        elements = []
-
-        title = Paragraph("Report for Brain Tumor Segmentation", styles["Title"])
-        elements.append(title)
-
-        slice_count = f"Layers count: {self.mri_data.shape[2]}"
-        elements.append(Paragraph(slice_count, styles["Normal"]))
-
-        middle_slices = [
-            self.mri_data[:, :, self.mri_data.shape[2] // 2],
-            self.mri_data[:, :, self.mri_data.shape[2] // 4],
-            self.mri_data[:, :, 3 * self.mri_data.shape[2] // 4],
-        ]
-
-        for i, slice_data in enumerate(middle_slices):
-            buf = io.BytesIO()
-            plt.figure()
-            plt.imshow(slice_data.T, cmap="gray", origin="lower")
-            plt.title(f"Layer {i + 1}")
-            plt.axis("off")
-            plt.savefig(buf, format="png")
-            plt.close()
-            buf.seek(0)
-
-            img = Image(buf)
-            img._restrictSize(400, 300)
-            elements.append(img)
-
-        description = """
-        This report includes basic MRI image data.,
-        as well as visualization of several sections, among which tumors or other pathologies may be visible.
-        """
-
-        elements.append(Paragraph(description, styles["Normal"]))
-
-        doc.build(elements)
+        file_path, selected_filter = file_dialog.getSaveFileName(
+            None, "Выберите путь для сохранения", "", f"{NIFTI_GZ_FILTER};;{NIFTI_FILTER}")
+        if not file_path:
+            return
+        if not file_path.endswith((".nii", ".nii.gz")):
+            file_path += ".nii" if selected_filter == NIFTI_FILTER else ".nii.gz"
+
+        # Разметка пишется в uint8, исходный том - в типе исходного файла;
+        # заголовок и аффинная матрица копируются из загруженного тома
+        labels = getattr(self, "segmentation_labels", None)
+        level = self.compression_combo.currentData()
+        if labels is not None and self.mri_data is labels:
+            worker = SaveWorker(save_labels, labels.copy(), file_path, self.volume, compresslevel=level)
+        else:
+            worker = SaveWorker(save_intensities, self.volume, file_path, compresslevel=level)
+        self.start_save_worker(worker, "save_segmentation", "Файл успешно сохранён!")
+
+    def start_save_worker(self, worker, operation, message):
+        worker.progress.connect(self.on_save_progress)
+        worker.done.connect(lambda path: self.on_save_done(path, message))
+        worker.failed.connect(self.on_save_failed)
+        worker.finished.connect(self.on_save_finished)
+
+        self.save_span = profiler.begin(operation)
+        self.save_worker = worker
+        self.save_image.setEnabled(False)
+        self.save_report.setEnabled(False)
+        worker.start()
+
+    def on_save_progress(self, percent):
+        self.statusbar.showMessage(f"Сохранение: {percent}%")
+
+    def on_save_done(self, path, message):
+        seconds = profiler.end(self.save_span)
+        self.statusbar.showMessage(f"Сохранено за {seconds:.1f} с: {path}")
+        QtWidgets.QMessageBox.information(None, "Удачно", message)
+
+    def on_save_failed(self, message):
+        self.statusbar.clearMessage()
+        QtWidgets.QMessageBox.critical(None, "Ошибка", f"Ошибка при сохранении: {message}")
+
+    def on_save_finished(self):
+        self.save_worker.deleteLater()
+        self.save_worker = None
+        self.save_image.setEnabled(True)
+        self.save_report.setEnabled(True)
 
     def save_report_func(self):
         if not hasattr(self, "mri_data") or self.mri_data is None:
             QtWidgets.QMessageBox.warning(None, "Ошибка", "Нет данных для отчета!")
             return
+        if getattr(self, "save_worker", None) is not None:
+            return
 
         file_dialog = QtWidgets.QFileDialog()
         file_path, _ = file_dialog.getSaveFileName(
@@ -303,55 +336,125 @@ class Ui_MainWindow(object):
         )
 
         if file_path:
-            try:
-                self.generate_pdf_report(file_path)
-                QtWidgets.QMessageBox.information(None, "Удачно", "Отчет успешно сохранён!")
-            except Exception as e:
-                QtWidgets.QMessageBox.critical(None, "Ошибка", f"Ошибка при сохранении: {e}")
+            # Срезы исходного тома с наложенной разметкой и объёмы классов, если сегментация уже есть
+            labels = getattr(self, "segmentation_labels", None)
+            worker = SaveWorker(generate_pdf_report, file_path, self.volume.data,
+                                None if labels is None else labels.copy(), self.volume,
+                                tumor_index=getattr(self, "tumor_index", None))
+            self.start_save_worker(worker, "generate_pdf_report", "Отчет успешно сохранён!")
 
     def run_segmentation(self):
-        dim = (IMG_SIZE, IMG_SIZE)
         if not hasattr(self, "mri_data") or self.mri_data is None:
             QtWidgets.QMessageBox.warning(None, "Ошибка", "Нет данных для сегментации!")
             return
-        
-        progress_dialog = QtWidgets.QProgressDialog("Сегментация в процессе...", "Отмена", 0, self.mri_data.shape[2])
-        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
-        progress_dialog.setMinimumDuration(0)
-        progress_dialog.setValue(0)
+        if getattr(self, "segmentation_worker", None) is not None:
+            return
 
+        # Форма берётся из исходного тома: после сегментации mri_data - разметка 128x128
+        height, width, n_slices = self.study.reference.shape[:3]
+        self.progress_dialog = QtWidgets.QProgressDialog("Сегментация в процессе...", "Отмена", 0, n_slices)
+        self.progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        self.progress_dialog.setMinimumDuration(0)
+        self.progress_dialog.setValue(0)
+
+        # Готовые срезы разметки показываются по мере поступления; в режиме тайлов
+        # разметка строится в исходном разрешении тома
+        tiled = self.tiled_checkbox.isChecked()
+        label_shape = (height, width) if tiled else (IMG_SIZE, IMG_SIZE)
+        self.segmentation_labels = np.zeros(label_shape + (n_slices,), dtype=np.uint8)
+        self.segmentation_error = None
+        self.tumor_index = None
+        self.segmentation_span = profiler.begin("run_segmentation")
+
+        worker = SegmentationWorker(self.model_loader, self.study, tiled=tiled, tta=self.tta_combo.currentData())
+        worker.stage.connect(self.on_segmentation_stage)
+        worker.progress.connect(self.on_segmentation_progress)
+        worker.batch_ready.connect(self.on_segmentation_batch)
+        worker.done.connect(self.on_segmentation_done)
+        worker.cancelled.connect(self.on_segmentation_cancelled)
+        worker.failed.connect(self.on_segmentation_failed)
+        worker.finished.connect(self.on_segmentation_finished)
+        self.progress_dialog.canceled.connect(worker.requestInterruption)
+
+        self.segmentation_worker = worker
+        self.segmentation.setEnabled(False)
+        worker.start()
+
+    def on_segmentation_stage(self, text):
+        self.progress_dialog.setLabelText(text)
+        self.statusbar.showMessage(text)
+
+    def on_segmentation_progress(self, done, total):
+        self.statusbar.showMessage(f"Сегментация: {done}/{total} срезов")
+        # setValue у модального диалога обрабатывает очередь событий, поэтому вызывается последним
+        self.progress_dialog.setValue(done)
+
+    def on_segmentation_batch(self, start, stop, labels):
+        if self.segmentation_error is not None:
+            return
+        first_batch = start == 0
         try:
-            # Подготовка входных данных
-            X = np.zeros((self.mri_data.shape[2], IMG_SIZE, IMG_SIZE, 1))  # Изменил на 1 канал, если у вас одноканальные изображения
-            for j in range(self.mri_data.shape[2]):
-                img = self.mri_data[:, :, j]
-                # Нормализация к диапазону [0, 1] для BRATS
-                img = (img - np.min(img)) / (np.max(img) - np.min(img) + 1e-8)
-                resized_img = PIL.Image.fromarray(img).resize((IMG_SIZE, IMG_SIZE))
-                X[j, :, :, 0] = np.array(resized_img)
-                progress_dialog.setValue(j + 1)
-                if progress_dialog.wasCanceled():
-                    break
-            progress_dialog.close()
-            
-            # Предсказание (убрал [0], если модель возвращает массив правильной формы)
-            segmented_data = model.predict(X, verbose=1)
-            
-            # Если segmented_data имеет размерность (N, H, W, C), берем первый канал или argmax
-            if segmented_data.ndim == 4:
-                segmented_data = np.argmax(segmented_data, axis=-1)  # для многоклассовой сегментации
-                # или segmented_data = segmented_data[..., 0]  # если нужен первый канал
-                
-            self.display_mri_slices(segmented_data)
-            self.display_3d_view(segmented_data)
+            self.segmentation_labels[:, :, start:stop] = labels
         except Exception as e:
-            QtWidgets.QMessageBox.critical(None, "Ошибка", f"Ошибка при сегментации: {e}")
+            # Исключение в слоте не должно закончиться "Сегментация завершена" с пустой разметкой
+            self.segmentation_error = str(e)
+            self.segmentation_worker.requestInterruption()
+            return
+        if first_batch:
+            self.display_mri_slices(self.segmentation_labels)
+        else:
+            self.refresh_slices()
+
+    def on_segmentation_done(self):
+        if self.segmentation_error is not None:
+            self.on_segmentation_failed(self.segmentation_error)
+            return
+        seconds = profiler.end(self.segmentation_span)
+        self.statusbar.showMessage(f"Сегментация завершена за {seconds:.1f} с")
+        # Индекс опухоли строится один раз; виды открываются на наибольшем сечении
+        with timed("tumor_index"):
+            self.tumor_index = TumorIndex(self.segmentation_labels)
+        for view in (self.x_axis, self.y_axis, self.z_axis):
+            view.set_tumor_index(self.tumor_index, jump=True)
+        self.display_label_meshes(self.segmentation_labels)
+
+    def display_label_meshes(self, labels):
+        # Разметка показывается поверхностями классов, а не полупрозрачным объёмом
+        self.clear_3d_view()
+        self.label_meshes.show(labels)
+
+    def on_segmentation_cancelled(self):
+        if self.segmentation_error is not None:
+            self.on_segmentation_failed(self.segmentation_error)
+            return
+        self.statusbar.showMessage("Сегментация отменена")
+
+    def on_segmentation_failed(self, message):
+        self.statusbar.clearMessage()
+        if self.segmentation_error is not None:
+            # Разметка не собрана - виды возвращаются к исходному тому
+            self.segmentation_labels = None
+            self.display_mri_slices(self.volume.data)
+        QtWidgets.QMessageBox.critical(None, "Ошибка", f"Ошибка при сегментации: {message}")
+
+    def on_segmentation_finished(self):
+        self.progress_dialog.close()
+        self.segmentation_worker.deleteLater()
+        self.segmentation_worker = None
+        self.segmentation.setEnabled(True)
 
 if __name__ == "__main__":
     import sys
-    app = QtWidgets.QApplication(sys.argv)
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=None, help="путь к файлу модели .keras/.tflite/.onnx (по умолчанию BT_MODEL_PATH)")
+    parser.add_argument("--backend", default=None, choices=BACKENDS, help="бэкенд инференса (по умолчанию по расширению модели)")
+    args, qt_args = parser.parse_known_args()
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     MainWindow = QtWidgets.QMainWindow()
     ui = Ui_MainWindow()
-    ui.setupUi(MainWindow)
+    ui.setupUi(MainWindow, model_path=args.model, model_backend=args.backend)
     MainWindow.show()
+    # Модель грузится в фоне уже после появления окна
+    QtCore.QTimer.singleShot(0, ui.start_model_warmup)
     sys.exit(app.exec_())
\ No newline at end of file
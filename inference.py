@@ -0,0 +1,248 @@
+"""Пакетный инференс U-Net с постобработкой argmax."""
+
+from functools import lru_cache
+
+import numpy as np
+
+from constants import IMG_SIZE
+from preprocessing import normalized_slice
+from profiling import timed
+
+BATCH_SIZE = 16
+
+# Варианты test-time augmentation в порядке добавления: (отразить по H, отразить по W,
+# число поворотов на 90°); первые n вариантов идут в тот же вызов модели, что и исходные срезы
+TTA_TRANSFORMS = (
+    (False, False, 0),
+    (False, True, 0),
+    (True, False, 0),
+    (True, True, 0),
+    (False, False, 1),
+    (False, False, 3),
+)
+MAX_TTA = len(TTA_TRANSFORMS)
+
+# Режим перекрывающихся тайлов: срезы не сжимаются до IMG_SIZE,
+# а режутся на окна IMG_SIZE x IMG_SIZE в исходном разрешении
+TILE_SIZE = IMG_SIZE
+TILE_OVERLAP = 0.5
+TILE_BATCH_SIZE = 64
+
+
+def model_input_size(model):
+    # None - модель сама сжимает и нормирует срезы (model_preprocessing.SlicePreprocessing),
+    # на вход идут срезы в исходном разрешении
+    return model.input_shape[1]
+
+
+def augment(X, transform):
+    # X: (N, H, W, C); отражения - представления без копии, копирует concatenate
+    flip_h, flip_w, k = transform
+    if flip_h:
+        X = X[:, ::-1]
+    if flip_w:
+        X = X[:, :, ::-1]
+    return np.rot90(X, k, axes=(1, 2)) if k else X
+
+
+def restore(probs, transform):
+    # Обратное преобразование выхода (N, H, W, классы) к ориентации исходного среза
+    flip_h, flip_w, k = transform
+    if k:
+        probs = np.rot90(probs, -k, axes=(1, 2))
+    if flip_w:
+        probs = probs[:, :, ::-1]
+    if flip_h:
+        probs = probs[:, ::-1]
+    return probs
+
+
+def predict_batch(model, X, tta=1):
+    # С TTA все варианты пакета идут в модель одним вызовом (размер пакета в tta раз больше),
+    # а softmax вариантов возвращается к исходной ориентации и усредняется
+    if tta <= 1:
+        with timed("predict_batch"):
+            return np.asarray(model.predict_on_batch(X))
+    transforms = TTA_TRANSFORMS[:tta]
+    if any(k for _, _, k in transforms) and X.shape[1] != X.shape[2]:
+        raise ValueError("Повороты TTA возможны только для квадратных срезов")
+    with timed("tta_augment"):
+        batch = np.concatenate([augment(X, t) for t in transforms])
+    with timed("predict_batch"):
+        probs = np.asarray(model.predict_on_batch(batch))
+    with timed("tta_merge"):
+        probs = probs.reshape((len(transforms), X.shape[0]) + probs.shape[1:])
+        merged = np.array(restore(probs[0], transforms[0]), dtype=np.float32)
+        for i in range(1, len(transforms)):
+            merged += restore(probs[i], transforms[i])
+        merged /= len(transforms)
+    return merged
+
+
+def tile_model(model):
+    # Тайлы вырезаются из срезов, нормированных целиком (normalized_slice); модели с
+    # предобработкой в графе они отдаются в саму U-Net, минуя повторную нормализацию
+    if model_input_size(model) is not None:
+        return model
+    from model_preprocessing import without_preprocessing
+    return without_preprocessing(model)
+
+
+def iter_probability_batches(model, X, batch_size=BATCH_SIZE, tta=1):
+    # Предсказываем по пакетам срезов, чтобы между ними можно было
+    # сообщить о прогрессе и прервать работу
+    for start in range(0, X.shape[0], batch_size):
+        stop = min(start + batch_size, X.shape[0])
+        yield start, stop, predict_batch(model, X[start:stop], tta)
+
+
+def iter_label_batches(model, X, batch_size=BATCH_SIZE, tta=1):
+    for start, stop, probs in iter_probability_batches(model, X, batch_size, tta):
+        yield start, stop, np.argmax(probs, axis=-1).astype(np.uint8)
+
+
+def to_volume_layout(labels):
+    # (срезы, H, W) -> (H, W, срезы), как у исходного тома
+    return np.moveaxis(labels, 0, -1)
+
+
+class VolumeReducer(object):
+    # Сводит поток пакетов softmax (срезы, H, W, классы) к нужным выходам, не храня
+    # вероятности всего тома: метки uint8 и, по запросу, карты отдельных классов в float16.
+    # Если в shape только число срезов, размер среза берётся из первого пакета
+    # (у модели с предобработкой в графе выход меньше входа)
+    def __init__(self, shape, labels=True, probability_classes=()):
+        self.with_labels = labels
+        self.probability_classes = probability_classes
+        self.labels = None
+        self.probabilities = {}
+        self.allocated = False
+        if len(shape) == 3:
+            self._allocate(shape)
+        else:
+            self.n_slices = shape[0]
+
+    def _allocate(self, shape):
+        self.labels = np.empty(shape, dtype=np.uint8) if self.with_labels else None
+        self.probabilities = {cls: np.empty(shape, dtype=np.float16) for cls in self.probability_classes}
+        self.allocated = True
+
+    def add(self, start, stop, probs):
+        if not self.allocated:
+            self._allocate((self.n_slices,) + probs.shape[1:3])
+        if self.labels is not None:
+            self.labels[start:stop] = np.argmax(probs, axis=-1)
+        for cls, out in self.probabilities.items():
+            out[start:stop] = probs[..., cls]
+
+    def result(self, volume_layout=True):
+        if not volume_layout:
+            return self.labels, self.probabilities
+        labels = to_volume_layout(self.labels) if self.labels is not None else None
+        return labels, {cls: to_volume_layout(p) for cls, p in self.probabilities.items()}
+
+
+def predict_volume(model, X, batch_size=BATCH_SIZE, labels=True, probability_classes=(), volume_layout=True, tta=1):
+    reducer = VolumeReducer(X.shape[:1], labels, probability_classes)
+    for start, stop, probs in iter_probability_batches(model, X, batch_size, tta):
+        reducer.add(start, stop, probs)
+    return reducer.result(volume_layout)
+
+
+def predict_labels(model, X, batch_size=BATCH_SIZE, tta=1):
+    return predict_volume(model, X, batch_size, tta=tta)[0]
+
+
+@lru_cache(maxsize=None)
+def gaussian_weights(size, sigma_scale=1.0 / 8):
+    # Вес тайла спадает к краям, где у U-Net меньше контекста
+    center = (size - 1) / 2
+    g = np.exp(-((np.arange(size) - center) ** 2) / (2 * (size * sigma_scale) ** 2))
+    weights = np.outer(g, g)
+    weights = np.maximum(weights / weights.max(), 1e-3).astype(np.float32)
+    weights.setflags(write=False)
+    return weights
+
+
+def tile_starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, stride))
+    if starts[-1] != length - tile:
+        starts.append(length - tile)
+    return starts
+
+
+def iter_tiled_probability_batches(model, volumes, n_channels, batch_size=TILE_BATCH_SIZE, overlap=TILE_OVERLAP,
+                                   tile=TILE_SIZE, tta=1):
+    # Тайлы всех срезов идут через буфер на batch_size окон; вероятности копятся
+    # только для срезов, тайлы которых ещё в работе, и готовые срезы отдаются сразу
+    # в исходном разрешении
+    model = tile_model(model)
+    height, width, n_slices = volumes[0].shape[:3]
+    padded = (max(height, tile), max(width, tile))
+    stride = max(1, int(round(tile * (1 - overlap))))
+    positions = [(y, x) for y in tile_starts(padded[0], tile, stride) for x in tile_starts(padded[1], tile, stride)]
+    weights = gaussian_weights(tile)[..., np.newaxis]
+    weight_sum = np.zeros(padded + (1,), dtype=np.float32)
+    for y, x in positions:
+        weight_sum[y:y + tile, x:x + tile] += weights
+
+    buffer = np.empty((batch_size, tile, tile, n_channels), dtype=np.float32)
+    coords = []
+    accumulators = {}
+    next_slice = 0
+
+    def flush():
+        nonlocal next_slice
+        probs = predict_batch(model, buffer[:len(coords)], tta)
+        for (k, y, x), p in zip(coords, probs):
+            acc = accumulators.get(k)
+            if acc is None:
+                acc = accumulators[k] = [np.zeros(padded + (p.shape[-1],), dtype=np.float32), len(positions)]
+            acc[0][y:y + tile, x:x + tile] += p * weights
+            acc[1] -= 1
+        coords.clear()
+
+        # Тайлы идут по порядку срезов, поэтому готовые срезы всегда идут подряд
+        start = next_slice
+        done = []
+        while next_slice in accumulators and accumulators[next_slice][1] == 0:
+            acc = accumulators.pop(next_slice)[0]
+            done.append((acc / weight_sum)[:height, :width])
+            next_slice += 1
+        if done:
+            return start, next_slice, np.stack(done)
+        return None
+
+    for k in range(n_slices):
+        img = normalized_slice(volumes, k, n_channels, min_size=tile)
+        for y, x in positions:
+            buffer[len(coords)] = img[y:y + tile, x:x + tile]
+            coords.append((k, y, x))
+            if len(coords) == batch_size:
+                ready = flush()
+                if ready is not None:
+                    yield ready
+    if coords:
+        ready = flush()
+        if ready is not None:
+            yield ready
+
+
+def iter_tiled_label_batches(model, volumes, n_channels, batch_size=TILE_BATCH_SIZE, overlap=TILE_OVERLAP, tta=1):
+    for start, stop, probs in iter_tiled_probability_batches(model, volumes, n_channels, batch_size, overlap, tta=tta):
+        yield start, stop, to_volume_layout(np.argmax(probs, axis=-1).astype(np.uint8))
+
+
+def predict_volume_tiled(model, volumes, n_channels, batch_size=TILE_BATCH_SIZE, overlap=TILE_OVERLAP,
+                         labels=True, probability_classes=(), volume_layout=True, tta=1):
+    height, width, n_slices = volumes[0].shape[:3]
+    reducer = VolumeReducer((n_slices, height, width), labels, probability_classes)
+    for start, stop, probs in iter_tiled_probability_batches(model, volumes, n_channels, batch_size, overlap, tta=tta):
+        reducer.add(start, stop, probs)
+    return reducer.result(volume_layout)
+
+
+def predict_labels_tiled(model, volumes, n_channels, batch_size=TILE_BATCH_SIZE, overlap=TILE_OVERLAP, tta=1):
+    return predict_volume_tiled(model, volumes, n_channels, batch_size, overlap, tta=tta)[0]
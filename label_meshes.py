@@ -0,0 +1,100 @@
+"""Поверхности классов сегментации для 3D-вида (marching cubes + упрощение)."""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pyqtgraph.opengl as gl
+from skimage.measure import marching_cubes
+
+from constants import CLASS_COLORS
+
+# Размер ячейки кластеризации вершин при упрощении сетки, в вокселях
+DECIMATE_VOXELS = 2.0
+MESH_CACHE_SIZE = 4
+
+_mesh_cache = OrderedDict()
+
+
+def decimate(verts, faces, cell=DECIMATE_VOXELS):
+    # Вершины из одной ячейки сетки сливаются в их среднее, вырожденные грани удаляются
+    cells = np.floor(verts / cell).astype(np.int64)
+    _, cluster, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    cluster = cluster.reshape(-1)
+    new_verts = np.zeros((counts.size, 3), dtype=np.float64)
+    np.add.at(new_verts, cluster, verts)
+    new_verts /= counts[:, np.newaxis]
+
+    new_faces = cluster[faces]
+    keep = ((new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2])
+            & (new_faces[:, 0] != new_faces[:, 2]))
+    new_faces = np.unique(new_faces[keep], axis=0)
+    return new_verts.astype(np.float32), new_faces.astype(np.int32)
+
+
+def class_mesh(labels, cls):
+    mask = labels == cls
+    if not mask.any():
+        return None
+    # Marching cubes только внутри ограничивающего прямоугольника класса
+    lo, hi = [], []
+    for axis in range(3):
+        present = np.flatnonzero(mask.any(axis=tuple(a for a in range(3) if a != axis)))
+        lo.append(present[0])
+        hi.append(present[-1] + 1)
+    # Рамка в один воксель замыкает поверхность у края прямоугольника
+    crop = np.pad(mask[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]], 1).astype(np.float32)
+    verts, faces, _, _ = marching_cubes(crop, level=0.5)
+    verts += np.array(lo, dtype=verts.dtype) - 1
+    return decimate(verts, faces)
+
+
+def label_meshes(labels):
+    labels = np.ascontiguousarray(labels)
+    key = (hashlib.sha1(labels.data).hexdigest(), labels.shape, labels.dtype.str)
+    if key in _mesh_cache:
+        _mesh_cache.move_to_end(key)
+        return _mesh_cache[key]
+
+    meshes = {cls: class_mesh(labels, cls) for cls in CLASS_COLORS}
+    _mesh_cache[key] = meshes
+    while len(_mesh_cache) > MESH_CACHE_SIZE:
+        _mesh_cache.popitem(last=False)
+    return meshes
+
+
+class LabelMeshRenderer(object):
+    def __init__(self, view):
+        self.view = view
+        self.items = {}
+        self.visible = {cls: True for cls in CLASS_COLORS}
+
+    def show(self, labels):
+        self.clear()
+        shape = labels.shape
+        for cls, mesh in label_meshes(labels).items():
+            if mesh is None:
+                continue
+            verts, faces = mesh
+            # Та же ориентация, что и у объёмного рендера: ось Y отражена
+            verts = verts.copy()
+            verts[:, 1] = shape[1] - 1 - verts[:, 1]
+            color = CLASS_COLORS[cls]
+            item = gl.GLMeshItem(
+                meshdata=gl.MeshData(vertexes=verts, faces=faces[:, ::-1]), color=color, smooth=True,
+                shader='shaded', glOptions='opaque' if color[3] == 1.0 else 'translucent')
+            item.translate(dx=-shape[0]/2, dy=-shape[1]/2, dz=-shape[2]/3)
+            item.setVisible(self.visible[cls])
+            self.view.addItem(item)
+            self.items[cls] = item
+
+    def set_visible(self, cls, visible):
+        self.visible[cls] = visible
+        if cls in self.items:
+            self.items[cls].setVisible(visible)
+
+    def clear(self):
+        for item in self.items.values():
+            if item in self.view.items:
+                self.view.removeItem(item)
+        self.items = {}
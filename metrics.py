@@ -0,0 +1,72 @@
+"""Метрики сегментации за один проход: матрица ошибок по классам и все производные от неё."""
+
+import tensorflow as tf
+from tensorflow import keras
+
+from constants import SEGMENT_CLASSES
+
+N_CLASSES = len(SEGMENT_CLASSES)
+
+# Имена столбцов training.log; Dice по классам - некроз (1), отёк (2), активная опухоль (3)
+CLASS_DICE_NAMES = {1: "dice_coef_necrotic", 2: "dice_coef_edema", 3: "dice_coef_enhancing"}
+METRIC_NAMES = ("accuracy", "mean_io_u", "dice_coef", "precision", "sensitivity", "specificity") + \
+    tuple(CLASS_DICE_NAMES.values())
+
+
+def ratio(numerator, denominator, empty=1.0):
+    # Класс, которого нет ни в разметке, ни в предсказании, считается совпавшим
+    return tf.where(denominator > 0, tf.math.divide_no_nan(numerator, denominator),
+                    tf.constant(empty, dtype=denominator.dtype))
+
+
+class SegmentationMetrics(keras.metrics.Metric):
+    # Одна матрица ошибок (истинный класс x предсказанный, по argmax) копится за эпоху;
+    # accuracy, MeanIoU, Dice и precision/sensitivity/specificity считаются из неё в result().
+    # precision, sensitivity и specificity - по сумме TP/FP/FN/TN всех классов, как прежние
+    # функции над one-hot тензорами
+    def __init__(self, num_classes=N_CLASSES, name="segmentation_metrics", **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.num_classes = num_classes
+        # float64: за эпоху набираются миллиарды вокселей, float32 теряет точность после 2**24
+        self.confusion = self.add_weight(name="confusion", shape=(num_classes, num_classes),
+                                         initializer="zeros", dtype="float64")
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        true = tf.reshape(tf.argmax(y_true, axis=-1), [-1])
+        pred = tf.reshape(tf.argmax(y_pred, axis=-1), [-1])
+        if sample_weight is not None:
+            sample_weight = tf.reshape(tf.broadcast_to(sample_weight, tf.shape(y_true)[:-1]), [-1])
+        self.confusion.assign_add(tf.math.confusion_matrix(true, pred, num_classes=self.num_classes,
+                                                           weights=sample_weight, dtype=tf.float64))
+
+    def result(self):
+        confusion = tf.convert_to_tensor(self.confusion)
+        tp = tf.linalg.diag_part(confusion)
+        fp = tf.reduce_sum(confusion, axis=0) - tp
+        fn = tf.reduce_sum(confusion, axis=1) - tp
+        total = tf.reduce_sum(confusion)
+        tn = total - tp - fp - fn
+
+        dice = ratio(2 * tp, 2 * tp + fp + fn)
+        # MeanIoU как в Keras: среднее по классам, встретившимся в разметке или предсказании
+        union = tp + fp + fn
+        present = tf.cast(union > 0, tf.float64)
+        results = {
+            "accuracy": ratio(tf.reduce_sum(tp), total),
+            "mean_io_u": ratio(tf.reduce_sum(ratio(tp, union) * present), tf.reduce_sum(present)),
+            "dice_coef": tf.reduce_mean(dice),
+            "precision": ratio(tf.reduce_sum(tp), tf.reduce_sum(tp + fp)),
+            "sensitivity": ratio(tf.reduce_sum(tp), tf.reduce_sum(tp + fn)),
+            "specificity": ratio(tf.reduce_sum(tn), tf.reduce_sum(tn + fp)),
+        }
+        for cls, name in CLASS_DICE_NAMES.items():
+            results[name] = dice[cls]
+        return {name: tf.cast(results[name], tf.float32) for name in METRIC_NAMES}
+
+    def reset_state(self):
+        self.confusion.assign(tf.zeros_like(self.confusion))
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(num_classes=self.num_classes)
+        return config
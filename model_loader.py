@@ -0,0 +1,75 @@
+"""Ленивая загрузка модели сегментации с прогревом в фоне."""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from backends import backend_for_path, load_backend
+from constants import IMG_SIZE
+
+DEFAULT_MODEL_PATH = '/home/bolgoff/braintumor/my_model.keras'
+MODEL_PATH = os.environ.get('BT_MODEL_PATH', DEFAULT_MODEL_PATH)
+# keras, tflite или onnx; по умолчанию определяется по расширению файла модели
+MODEL_BACKEND = os.environ.get('BT_MODEL_BACKEND')
+
+
+class ModelLoader(object):
+    def __init__(self, path, backend=None):
+        self.path = path
+        self.backend = backend or backend_for_path(path)
+        self.model = None
+        self.load_time = None
+        self._lock = threading.Lock()
+
+    def is_loaded(self):
+        return self.model is not None
+
+    def get(self):
+        # TensorFlow или ONNX Runtime импортируются только при первой загрузке. Модель
+        # сразу прогоняется на нулевом пакете (трассировка графа, выделение тензоров
+        # интерпретатора), и первая сегментация за это уже не платит; под блокировкой,
+        # чтобы прогрев не шёл одновременно с инференсом
+        with self._lock:
+            if self.model is None:
+                start = time.perf_counter()
+                model = load_backend(self.path, self.backend)
+                model.predict_on_batch(warm_up_batch(model))
+                self.model = model
+                self.load_time = time.perf_counter() - start
+        return self.model
+
+    def warm_up(self, on_done=None, on_error=None):
+        def target():
+            try:
+                self.get()
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e)
+                return
+            if on_done is not None:
+                on_done(self.load_time)
+
+        thread = threading.Thread(target=target, name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+
+def warm_up_batch(model):
+    # Один нулевой срез; высота и ширина, не заданные у модели (предобработка в графе), - IMG_SIZE
+    shape = tuple(IMG_SIZE if d is None else d for d in model.input_shape[1:])
+    return np.zeros((1,) + shape, dtype=np.float32)
+
+
+_loaders = {}
+_loaders_lock = threading.Lock()
+
+
+def get_loader(path=None, backend=None):
+    path = os.path.abspath(os.path.expanduser(path or MODEL_PATH))
+    key = (path, backend or MODEL_BACKEND or backend_for_path(path))
+    with _loaders_lock:
+        if key not in _loaders:
+            _loaders[key] = ModelLoader(*key)
+        return _loaders[key]
@@ -0,0 +1,81 @@
+"""Предобработка срезов внутри графа модели: ресемплинг и нормализация слоем Keras."""
+
+from functools import lru_cache
+
+import tensorflow as tf
+from tensorflow import keras
+
+from constants import IMG_SIZE
+
+NORMALIZATION_EPSILON = 1e-8
+
+
+class SlicePreprocessing(keras.layers.Layer):
+    # Сырые срезы (N, H, W, C) любого размера -> (N, img_size, img_size, C) в [0, 1].
+    # Те же операции, что в preprocessing.normalize_and_resize: бикубический ресемплинг
+    # с антиалиасингом (ядро Кейса, a = -0.5, как у PIL) и min-max каждого канала
+    # по исходному срезу
+    def __init__(self, img_size=IMG_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.img_size = img_size
+
+    def call(self, inputs):
+        inputs = tf.cast(inputs, tf.float32)
+        lo = tf.reduce_min(inputs, axis=[1, 2], keepdims=True)
+        hi = tf.reduce_max(inputs, axis=[1, 2], keepdims=True)
+        # Веса ресемплинга в сумме дают 1, поэтому нормировать можно уже уменьшенный срез
+        resized = tf.image.resize(inputs, (self.img_size, self.img_size), method="bicubic", antialias=True)
+        return (resized - lo) / (hi - lo + NORMALIZATION_EPSILON)
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], self.img_size, self.img_size, input_shape[-1])
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(img_size=self.img_size)
+        return config
+
+
+CUSTOM_OBJECTS = {"SlicePreprocessing": SlicePreprocessing}
+
+
+def preprocessing_input(n_channels, img_size=IMG_SIZE, name="slices"):
+    # Вход модели - срезы в исходном разрешении; в сеть идёт (N, img_size, img_size, C)
+    inputs = keras.Input((None, None, n_channels), name=name)
+    return inputs, SlicePreprocessing(img_size, name="preprocessing")(inputs)
+
+
+def with_preprocessing(model):
+    # Обёртка для U-Net, обученной на уже сжатых и нормированных срезах
+    inputs, x = preprocessing_input(model.input_shape[-1], model.input_shape[1])
+    return keras.Model(inputs=inputs, outputs=model(x), name=f"{model.name}_preprocessed")
+
+
+def preprocessing_layer(model):
+    for layer in getattr(model, "layers", ()):
+        if isinstance(layer, SlicePreprocessing):
+            return layer
+    return None
+
+
+@lru_cache(maxsize=4)
+def without_preprocessing(model):
+    # Та же сеть с теми же весами, но со входом (img_size, img_size, C) и без слоя
+    # предобработки. Нужна для тайлов (они вырезаются из уже нормированного целиком
+    # среза, повторный min-max каждого тайла сдвинул бы их шкалы) и для экспорта:
+    # ScaleAndTranslate (бикубический ресемплинг с антиалиасингом) нет ни среди
+    # встроенных операций TFLite, ни в tf2onnx, поэтому для экспортированной модели
+    # срезы готовит preprocessing.normalize_and_resize - те же операции в NumPy
+    layer = preprocessing_layer(model)
+    if layer is None:
+        return model
+
+    def clone(original):
+        if original is layer:
+            return keras.layers.Activation("linear", name=original.name)
+        return original.__class__.from_config(original.get_config())
+
+    inputs = keras.Input((layer.img_size, layer.img_size, model.input_shape[-1]), name="slices")
+    inner = keras.models.clone_model(model, input_tensors=inputs, clone_function=clone)
+    inner.set_weights(model.get_weights())
+    return inner
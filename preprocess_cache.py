@@ -0,0 +1,123 @@
+"""Дисковый кэш предобработанных случаев BraTS в формате .npy с чтением через mmap."""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from brats_data import TRAINING_MODALITIES, case_file, load_training_case
+from constants import VOLUME_SLICES, VOLUME_START_AT
+
+CACHE_VERSION = 2
+HASH_CHUNK = 1 << 20
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def preprocessing_params():
+    return {
+        'version': CACHE_VERSION,
+        'VOLUME_START_AT': VOLUME_START_AT,
+        'VOLUME_SLICES': VOLUME_SLICES,
+    }
+
+
+class PreprocessCache(object):
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def entry_dir(self, case_id):
+        return os.path.join(self.cache_dir, case_id)
+
+    def _sources(self, dataset_path, case_id):
+        sources = {m: case_file(dataset_path, case_id, m) for m in TRAINING_MODALITIES}
+        seg = case_file(dataset_path, case_id, 'seg')
+        if os.path.exists(seg):
+            sources['seg'] = seg
+        return sources
+
+    def _read_meta(self, entry):
+        try:
+            with open(os.path.join(entry, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_fresh(self, meta, sources, params):
+        # Возвращает (запись актуальна, нужно переписать meta.json)
+        if meta is None or meta['params'] != params or set(meta['sources']) != set(sources):
+            return False, False
+        stale = []
+        for name, path in sources.items():
+            st = os.stat(path)
+            info = meta['sources'][name]
+            if info['size'] != st.st_size or info['mtime_ns'] != st.st_mtime_ns:
+                stale.append((name, path, st))
+        # Изменилось только время файла - сверяем содержимое по хэшу
+        for name, path, st in stale:
+            info = meta['sources'][name]
+            if info['size'] != st.st_size or info['sha1'] != file_sha1(path):
+                return False, False
+            info['mtime_ns'] = st.st_mtime_ns
+        return True, bool(stale)
+
+    def _write_meta(self, entry, meta):
+        tmp = os.path.join(entry, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp, os.path.join(entry, 'meta.json'))
+
+    def ensure(self, dataset_path, case_id):
+        entry = self.entry_dir(case_id)
+        sources = self._sources(dataset_path, case_id)
+        params = preprocessing_params()
+        meta = self._read_meta(entry)
+
+        fresh, touched = self._is_fresh(meta, sources, params)
+        if fresh:
+            if touched:
+                self._write_meta(entry, meta)
+            return entry
+
+        # Устаревшая запись удаляется целиком и собирается заново
+        shutil.rmtree(entry, ignore_errors=True)
+        tmp_entry = entry + f'.tmp{os.getpid()}'
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        os.makedirs(tmp_entry)
+
+        X, y = load_training_case(dataset_path, case_id, with_seg='seg' in sources)
+        # Срезы хранятся без изменений: в исходном типе (обычно int16) они точны и компактнее float32
+        np.save(os.path.join(tmp_entry, 'X.npy'), X)
+        if y is not None:
+            np.save(os.path.join(tmp_entry, 'y.npy'), y)
+
+        meta = {'case_id': case_id, 'params': params, 'sources': {}}
+        for name, path in sources.items():
+            st = os.stat(path)
+            meta['sources'][name] = {'path': os.path.abspath(path), 'size': st.st_size,
+                                     'mtime_ns': st.st_mtime_ns, 'sha1': file_sha1(path)}
+        self._write_meta(tmp_entry, meta)
+        try:
+            os.replace(tmp_entry, entry)
+        except OSError:
+            # Запись уже собрал другой процесс
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        return entry
+
+    def load(self, dataset_path, case_id):
+        return load_entry(self.ensure(dataset_path, case_id))
+
+
+def load_entry(entry):
+    X = np.load(os.path.join(entry, 'X.npy'), mmap_mode='r')
+    y_path = os.path.join(entry, 'y.npy')
+    y = np.load(y_path, mmap_mode='r') if os.path.exists(y_path) else None
+    return X, y
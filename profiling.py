@@ -0,0 +1,125 @@
+"""Таймеры операций интерфейса: скользящая статистика в памяти и трасса для просмотрщика трасс.
+
+BT_TRACE=trace.json - при выходе записать все замеры в формате Chrome Trace Event
+(chrome://tracing, https://ui.perfetto.dev); BT_PROFILE=1 - сразу показать сводку
+в строке состояния (переключается клавишей F12).
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+TRACE_ENV = 'BT_TRACE'
+OVERLAY_ENV = 'BT_PROFILE'
+# Сколько последних замеров каждой операции хранится для статистики
+WINDOW = 256
+MAX_TRACE_EVENTS = 200000
+# Границы корзин гистограммы в секундах: от 0.1 мс до 100 с по логарифмической шкале
+HISTOGRAM_EDGES = np.geomspace(1e-4, 100, 25)
+
+
+class Profiler(object):
+    def __init__(self, window=WINDOW, trace_path=None):
+        self.window = window
+        self.samples = {}
+        self.trace_path = trace_path
+        self.events = deque(maxlen=MAX_TRACE_EVENTS) if trace_path else None
+        self.thread_names = {}
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name, start, duration):
+        with self._lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+            samples.append(duration)
+            if self.events is not None:
+                thread = threading.current_thread()
+                self.thread_names[thread.ident] = thread.name
+                self.events.append((name, start, duration, thread.ident))
+
+    def begin(self, name):
+        # Для операций, которые начинаются и заканчиваются в разных слотах Qt
+        return name, time.perf_counter()
+
+    def end(self, span):
+        name, start = span
+        duration = time.perf_counter() - start
+        self.record(name, start, duration)
+        return duration
+
+    def stats(self, name):
+        with self._lock:
+            samples = np.array(self.samples.get(name, ()))
+        if not len(samples):
+            return None
+        return {"count": len(samples), "last": samples[-1], "avg": samples.mean(), "p95": np.percentile(samples, 95)}
+
+    def histogram(self, name, edges=HISTOGRAM_EDGES):
+        with self._lock:
+            samples = np.array(self.samples.get(name, ()))
+        return np.histogram(samples, bins=edges)[0], edges
+
+    def names(self):
+        with self._lock:
+            return list(self.samples)
+
+    def summary(self, separator=" | "):
+        parts = []
+        for name in self.names():
+            s = self.stats(name)
+            parts.append(f"{name} {s['last'] * 1000:.0f}/{s['avg'] * 1000:.0f}/{s['p95'] * 1000:.0f} мс")
+        return separator.join(parts)
+
+    def dump_trace(self, path=None):
+        path = path or self.trace_path
+        with self._lock:
+            events = list(self.events or ())
+            thread_names = dict(self.thread_names)
+        pid = os.getpid()
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in thread_names.items()]
+        trace += [{"name": name, "cat": "bt", "ph": "X", "pid": pid, "tid": tid,
+                   "ts": (start - self.origin) * 1e6, "dur": duration * 1e6}
+                  for name, start, duration, tid in events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+class timed(object):
+    # with timed("имя"): ... или @timed("имя") над функцией
+    def __init__(self, name, profiler=None):
+        self.name = name
+        self.profiler = profiler
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        (self.profiler or profiler).record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.name, self.profiler):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def overlay_enabled():
+    return bool(os.environ.get(OVERLAY_ENV))
+
+
+profiler = Profiler(trace_path=os.environ.get(TRACE_ENV) or None)
+if profiler.trace_path:
+    atexit.register(profiler.dump_trace)
@@ -0,0 +1,174 @@
+"""PDF-отчёт по тому и сегментации: PNG прямо из массивов, статистика классов за один проход."""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image as PILImage
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Spacer, Table, TableStyle
+
+from constants import CLASS_COLORS, SEGMENT_CLASSES
+from slice_cache import render_rgba
+from tumor_index import TumorIndex
+from volume_io import resized_affine
+
+# Шрифты ReportLab по умолчанию без кириллицы, поэтому названия классов в отчёте английские
+REPORT_CLASS_NAMES = {
+    1: "Necrotic / non-enhancing core",
+    2: "Peritumoral edema",
+    3: "Enhancing tumor",
+}
+# Доля глубины тома для срезов в отчёте
+REPORT_DEPTHS = (0.5, 0.25, 0.75)
+IMAGE_SIZE = (400, 300)
+# PNG всё равно распаковывается ReportLab и пережимается в PDF, поэтому сжатие минимальное
+PNG_COMPRESS_LEVEL = 1
+OVERLAY_ALPHA = 0.45
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+
+# Изображения пишутся в PDF двоичными потоками: кодирование ASCII85 без ускорителя
+# rl_accel идёт на чистом Python и занимает большую часть времени построения отчёта
+rl_config.useA85 = 0
+
+# PIL отпускает GIL при кодировании PNG, так что потоки рисуют срезы параллельно
+_render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="report-render")
+
+
+def voxel_volume(affine):
+    # Объём вокселя в мм³ - модуль определителя линейной части аффинной матрицы
+    return abs(float(np.linalg.det(np.asarray(affine)[:3, :3])))
+
+
+def label_voxel_volume(labels, reference=None):
+    if reference is None:
+        return 1.0
+    affine = reference.affine
+    if tuple(labels.shape[:2]) != tuple(reference.shape[:2]):
+        affine = resized_affine(affine, reference.shape, labels.shape)
+    return voxel_volume(affine)
+
+
+def report_slices(depth, tumor_index=None):
+    # Осевые срезы с наибольшим сечением опухоли; без разметки - на ¼, ½ и ¾ глубины
+    if tumor_index is not None and not tumor_index.is_empty():
+        return sorted(tumor_index.largest_slices(2, len(REPORT_DEPTHS)))
+    return [min(depth - 1, int(depth * f)) for f in REPORT_DEPTHS]
+
+
+def overlay_lut():
+    lut = np.zeros((256, 4), dtype=np.float32)
+    for cls, (r, g, b, _) in CLASS_COLORS.items():
+        lut[cls] = (r * 255, g * 255, b * 255, OVERLAY_ALPHA)
+    return lut
+
+
+_overlay_lut = overlay_lut()
+
+
+def slice_png(image_slice, label_slice=None):
+    # Срез (H, W) -> PNG без фигуры matplotlib; ориентация как у imshow(slice.T, origin="lower")
+    rgb = render_rgba(image_slice.T)[::-1, :, :3]
+    if label_slice is not None:
+        labels = np.asarray(label_slice, dtype=np.uint8)
+        if labels.shape != image_slice.shape:
+            labels = np.asarray(PILImage.fromarray(labels.T).resize(image_slice.shape, PILImage.NEAREST)).T
+        color = _overlay_lut[labels.T[::-1]]
+        alpha = color[..., 3:]
+        rgb = (rgb * (1 - alpha) + color[..., :3] * alpha).astype(np.uint8)
+    buf = io.BytesIO()
+    PILImage.fromarray(np.ascontiguousarray(rgb)).save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
+
+
+def render_slices(image, labels, indices):
+    futures = [_render_pool.submit(slice_png, image[:, :, k], None if labels is None else labels[:, :, k])
+               for k in indices]
+    return [f.result() for f in futures]
+
+
+def statistics_table(counts, volumes):
+    rows = [["Class", "Voxels", "Volume, mm³", "Volume, ml"]]
+    for cls in sorted(REPORT_CLASS_NAMES):
+        rows.append([REPORT_CLASS_NAMES[cls], f"{counts[cls]:,}", f"{volumes[cls]:,.0f}", f"{volumes[cls] / 1000:.2f}"])
+    tumor = slice(1, len(SEGMENT_CLASSES))
+    rows.append(["Whole tumor", f"{counts[tumor].sum():,}", f"{volumes[tumor].sum():,.0f}",
+                 f"{volumes[tumor].sum() / 1000:.2f}"])
+    table = Table(rows, hAlign="LEFT")
+    table.setStyle(TableStyle([
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
+        ("ALIGN", (1, 0), (-1, -1), "RIGHT"),
+        ("LINEBELOW", (0, 0), (-1, 0), 0.5, colors.grey),
+        ("LINEABOVE", (0, -1), (-1, -1), 0.5, colors.grey),
+    ]))
+    return table
+
+
+def case_summary(image, labels=None, reference=None, title=None, tumor_index=None):
+    # Всё, что нужно для страниц отчёта: статистика и PNG срезов; словарь компактный
+    # и передаётся между процессами вместо томов
+    summary = {"title": title, "shape": tuple(image.shape[:3]), "zooms": None, "counts": None, "volumes": None,
+               "tumor_box": None}
+    if reference is not None:
+        summary["zooms"] = tuple(np.sqrt((np.asarray(reference.affine)[:3, :3] ** 2).sum(axis=0)))
+    if labels is not None:
+        # Число вокселей классов берётся из индекса опухоли, второго прохода по тому нет
+        if tumor_index is None:
+            tumor_index = TumorIndex(labels)
+        counts = tumor_index.counts[2].sum(axis=0)
+        summary["counts"], summary["volumes"] = counts, counts * label_voxel_volume(labels, reference)
+        summary["tumor_box"] = tumor_index.tumor_box
+    indices = report_slices(image.shape[2], tumor_index)
+    summary["slices"] = list(zip(indices, render_slices(image, labels, indices)))
+    return summary
+
+
+def summary_elements(summary, styles=None):
+    styles = styles or getSampleStyleSheet()
+    elements = [Paragraph(summary["title"] or "Report for Brain Tumor Segmentation", styles["Title"])]
+
+    shape = summary["shape"]
+    info = [f"Layers count: {shape[2]}", f"Dimensions: {' x '.join(map(str, shape))}"]
+    if summary["zooms"] is not None:
+        info.append(f"Voxel size: {' x '.join(f'{z:.2f}' for z in summary['zooms'])} mm")
+    for line in info:
+        elements.append(Paragraph(line, styles["Normal"]))
+
+    if summary["counts"] is not None:
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph("Segmentation", styles["Heading2"]))
+        elements.append(statistics_table(summary["counts"], summary["volumes"]))
+        if summary["tumor_box"] is not None:
+            extent = ", ".join(f"{axis} {lo}-{hi}" for axis, (lo, hi) in zip("xyz", summary["tumor_box"]))
+            elements.append(Paragraph(f"Tumor extent (label voxels): {extent}", styles["Normal"]))
+
+    elements.append(Spacer(1, 12))
+    for k, png in summary["slices"]:
+        elements.append(Paragraph(f"Layer {k + 1} of {shape[2]}", styles["Heading3"]))
+        img = Image(io.BytesIO(png))
+        img._restrictSize(*IMAGE_SIZE)
+        elements.append(img)
+
+    description = """
+    This report includes basic MRI image data,
+    as well as visualization of several sections, among which tumors or other pathologies may be visible.
+    """
+    elements.append(Paragraph(description, styles["Normal"]))
+    return elements
+
+
+def generate_pdf_report(file_path, image, labels=None, reference=None, progress=None, title=None, tumor_index=None):
+    # labels - разметка (H', W', срезы), возможно в уменьшенном разрешении; reference -
+    # исходный том (affine, shape) для размера вокселя
+    elements = summary_elements(case_summary(image, labels, reference, title, tumor_index))
+    if progress is not None:
+        progress(1, 2)
+    SimpleDocTemplate(file_path, pagesize=letter).build(elements)
+    if progress is not None:
+        progress(2, 2)
+    return file_path
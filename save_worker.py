@@ -0,0 +1,30 @@
+"""Сохранение томов и отчётов в отдельном потоке Qt с прогрессом."""
+
+from PyQt5 import QtCore
+
+
+class SaveWorker(QtCore.QThread):
+    progress = QtCore.pyqtSignal(int)
+    failed = QtCore.pyqtSignal(str)
+    done = QtCore.pyqtSignal(str)
+
+    def __init__(self, save, *args, parent=None, **kwargs):
+        super().__init__(parent)
+        self.save = save
+        self.args = args
+        self.kwargs = kwargs
+        self.percent = -1
+
+    def report(self, written, total):
+        # Сигнал только при смене процента, а не на каждый записанный блок
+        percent = 100 * written // total if total else 100
+        if percent != self.percent:
+            self.percent = percent
+            self.progress.emit(percent)
+
+    def run(self):
+        try:
+            path = self.save(*self.args, progress=self.report, **self.kwargs)
+            self.done.emit(path)
+        except Exception as e:
+            self.failed.emit(str(e))
@@ -0,0 +1,59 @@
+"""Сегментация в отдельном потоке Qt с потоковой выдачей результата."""
+
+from PyQt5 import QtCore
+
+from inference import BATCH_SIZE, iter_label_batches, iter_tiled_label_batches, model_input_size, to_volume_layout
+
+
+class SegmentationWorker(QtCore.QThread):
+    stage = QtCore.pyqtSignal(str)
+    progress = QtCore.pyqtSignal(int, int)
+    batch_ready = QtCore.pyqtSignal(int, int, object)
+    failed = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+    done = QtCore.pyqtSignal()
+
+    def __init__(self, model_loader, study, batch_size=BATCH_SIZE, tiled=False, tta=1, parent=None):
+        super().__init__(parent)
+        self.model_loader = model_loader
+        self.study = study
+        self.batch_size = batch_size
+        self.tiled = tiled
+        self.tta = tta
+
+    def run(self):
+        try:
+            n_slices = self.study.reference.shape[2]
+            if not self.model_loader.is_loaded():
+                self.stage.emit("Загрузка модели...")
+            model = self.model_loader.get()
+            if self.isInterruptionRequested():
+                self.cancelled.emit()
+                return
+
+            # Каналы модели (FLAIR, T1CE) берутся из исследования; без модальности канал нулевой
+            n_channels = model.input_shape[-1]
+            missing = self.study.missing(n_channels)
+            if missing:
+                self.stage.emit(f"Нет модальностей {', '.join(missing)}: каналы заполнены нулями")
+            if self.tiled:
+                # Тайлы в исходном разрешении, метки сразу в раскладке тома
+                batches = iter_tiled_label_batches(model, self.study.channel_volumes(n_channels), n_channels,
+                                                   tta=self.tta)
+            else:
+                self.stage.emit("Подготовка данных...")
+                X = self.study.model_input(n_channels, model_input_size(model))
+                batches = ((start, stop, to_volume_layout(labels))
+                           for start, stop, labels in iter_label_batches(model, X, self.batch_size, self.tta))
+
+            self.stage.emit("Сегментация в процессе...")
+            for start, stop, labels in batches:
+                # Отмена проверяется между пакетами, в том числе во время инференса
+                if self.isInterruptionRequested():
+                    self.cancelled.emit()
+                    return
+                self.batch_ready.emit(start, stop, labels)
+                self.progress.emit(stop, n_slices)
+            self.done.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
@@ -0,0 +1,65 @@
+"""LRU-кэш отрисованных срезов в RGBA с ограничением по памяти."""
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import matplotlib
+import numpy as np
+
+CACHE_BYTES = 64 * 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def colormap_lut(cmap_name):
+    return matplotlib.colormaps[cmap_name](np.linspace(0.0, 1.0, 256), bytes=True)
+
+
+def volume_slice(volume, axis, index):
+    # Обычная индексация даёт представление без копии; np.take на томах NIfTI
+    # (порядок Fortran) копирует весь срез поэлементно и в десятки раз медленнее
+    return volume[(slice(None),) * axis + (index,)]
+
+
+def render_rgba(image_slice, window=None, cmap_name='gray'):
+    # window = (vmin, vmax); None - по минимуму и максимуму среза, как imshow
+    image_slice = np.asarray(image_slice, dtype=np.float32)
+    vmin, vmax = window if window is not None else (image_slice.min(), image_slice.max())
+    scale = 255.0 / (vmax - vmin) if vmax > vmin else 0.0
+    index = np.clip((image_slice - vmin) * scale, 0, 255).astype(np.uint8)
+    return colormap_lut(cmap_name)[index]
+
+
+class SliceCache(object):
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def get(self, key):
+        with self._lock:
+            rgba = self._items.get(key)
+            if rgba is not None:
+                self._items.move_to_end(key)
+            return rgba
+
+    def put(self, key, rgba):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._items[key] = rgba
+            self.nbytes += rgba.nbytes
+            while self.nbytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
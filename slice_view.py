@@ -0,0 +1,200 @@
+"""Виджет среза тома с постоянным AxesImage и отрисовкой через blit."""
+
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5 import QtCore, QtWidgets
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+from profiling import timed
+from slice_cache import SliceCache, render_rgba, volume_slice
+
+# Быстрое перетаскивание слайдера сводится к одному кадру на интервал (~60 кадров/с)
+FRAME_INTERVAL_MS = 16
+# Сколько следующих срезов по направлению перетаскивания готовится заранее
+PREFETCH_SLICES = 4
+
+_volume_ids = itertools.count()
+_prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slice-prefetch")
+
+
+class SliceView(QtWidgets.QWidget):
+    def __init__(self, label_text, axis, parent=None):
+        super().__init__(parent)
+        self.axis = axis
+        self.slice_data = None
+        self.volume_id = None
+        self.window = None
+        self.cmap = 'gray'
+        self.image = None
+        self.background = None
+        self.cache = SliceCache()
+        self.last_index = None
+        self.direction = 1
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        self.tumor_index = None
+
+        layout = QtWidgets.QVBoxLayout(self)
+
+        label = QtWidgets.QLabel(label_text)
+        label.setAlignment(QtCore.Qt.AlignCenter)
+        label.setStyleSheet("color: #D8DEE9; font-size: 16px;")
+        layout.addWidget(label)
+
+        self.canvas = FigureCanvas(Figure())
+        self.ax = self.canvas.figure.add_subplot(111)
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        layout.addWidget(self.canvas)
+
+        self.slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.slider.setMinimum(0)
+        self.slider.setStyleSheet(
+            "QSlider::groove:horizontal { background: #4C566A; height: 8px; }"
+            "QSlider::handle:horizontal { background: #88C0D0; width: 16px; border-radius: 8px; margin: -4px 0; }"
+        )
+        self.slider.valueChanged.connect(self.schedule_render)
+
+        # Переход к предыдущему/следующему срезу с опухолью по индексу разметки
+        button_style = ("QPushButton { color: #D8DEE9; background-color: #4C566A; border-radius: 4px; padding: 2px 8px; }"
+                        "QPushButton:disabled { color: #616E88; }")
+        self.prev_tumor_button = QtWidgets.QPushButton("◀")
+        self.prev_tumor_button.setToolTip("Предыдущий срез с опухолью")
+        self.next_tumor_button = QtWidgets.QPushButton("▶")
+        self.next_tumor_button.setToolTip("Следующий срез с опухолью")
+        for button in (self.prev_tumor_button, self.next_tumor_button):
+            button.setStyleSheet(button_style)
+            button.setEnabled(False)
+        self.prev_tumor_button.clicked.connect(self.prev_tumor_slice)
+        self.next_tumor_button.clicked.connect(self.next_tumor_slice)
+
+        slider_layout = QtWidgets.QHBoxLayout()
+        slider_layout.addWidget(self.prev_tumor_button)
+        slider_layout.addWidget(self.slider, 1)
+        slider_layout.addWidget(self.next_tumor_button)
+        layout.addLayout(slider_layout)
+
+        self.render_timer = QtCore.QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(FRAME_INTERVAL_MS)
+        self.render_timer.timeout.connect(self.render)
+
+    def set_volume(self, data, index=None):
+        self.slice_data = data
+        self.set_tumor_index(None)
+        self.invalidate()
+        self.image = None
+        self.slider.blockSignals(True)
+        self.slider.setMaximum(data.shape[self.axis] - 1)
+        self.slider.setValue(data.shape[self.axis] // 2 if index is None else index)
+        self.slider.blockSignals(False)
+        self.render()
+
+    def set_tumor_index(self, tumor_index, jump=False):
+        # Индекс строится по разметке той же формы, что показываемый том
+        self.tumor_index = tumor_index
+        enabled = tumor_index is not None and not tumor_index.is_empty()
+        self.prev_tumor_button.setEnabled(enabled)
+        self.next_tumor_button.setEnabled(enabled)
+        if enabled and jump:
+            self.slider.setValue(tumor_index.largest_slice(self.axis))
+
+    def prev_tumor_slice(self):
+        if self.tumor_index is not None:
+            index = self.tumor_index.prev_slice(self.axis, self.slider.value())
+            if index is not None:
+                self.slider.setValue(index)
+
+    def next_tumor_slice(self):
+        if self.tumor_index is not None:
+            index = self.tumor_index.next_slice(self.axis, self.slider.value())
+            if index is not None:
+                self.slider.setValue(index)
+
+    def invalidate(self):
+        # Данные тома изменились (новый том или пришли срезы сегментации)
+        self.volume_id = next(_volume_ids)
+        self.cache.clear()
+        self.last_index = None
+
+    def set_window(self, window=None, cmap=None):
+        self.window = window
+        self.cmap = cmap or self.cmap
+        self.render()
+
+    def cache_key(self, index):
+        return (self.volume_id, self.axis, index, self.window, self.cmap)
+
+    def rendered_slice(self, index):
+        key = self.cache_key(index)
+        rgba = self.cache.get(key)
+        if rgba is None:
+            rgba = render_rgba(volume_slice(self.slice_data, self.axis, index).T, self.window, self.cmap)
+            self.cache.put(key, rgba)
+        return rgba
+
+    def prefetch(self, index):
+        if self.last_index is not None and index != self.last_index:
+            self.direction = 1 if index > self.last_index else -1
+        self.last_index = index
+
+        last = self.slice_data.shape[self.axis] - 1
+        for step in range(1, PREFETCH_SLICES + 1):
+            neighbour = index + step * self.direction
+            if neighbour < 0 or neighbour > last:
+                break
+            key = self.cache_key(neighbour)
+            with self.pending_lock:
+                if key in self.pending or key in self.cache:
+                    continue
+                self.pending.add(key)
+            _prefetch_pool.submit(self.prefetch_slice, self.slice_data, neighbour, key)
+
+    def prefetch_slice(self, data, index, key):
+        try:
+            if key[0] != self.volume_id:
+                return
+            window, cmap = key[3], key[4]
+            rgba = render_rgba(volume_slice(data, self.axis, index).T, window, cmap)
+            # После invalidate() срез старого тома уже не понадобится, а место в LRU займёт
+            if key[0] == self.volume_id:
+                self.cache.put(key, rgba)
+        finally:
+            with self.pending_lock:
+                self.pending.discard(key)
+
+    def schedule_render(self):
+        # Пока таймер идёт, новые значения слайдера только запоминаются
+        if not self.render_timer.isActive():
+            self.render_timer.start()
+
+    @timed("slice_render")
+    def render(self):
+        if self.slice_data is None:
+            return
+        index = self.slider.value()
+        rgba = self.rendered_slice(index)
+        self.prefetch(index)
+
+        if self.image is None or self.image.get_array().shape != rgba.shape:
+            self.ax.clear()
+            self.image = self.ax.imshow(rgba, origin="lower", animated=True)
+            self.background = None
+            self.canvas.draw()
+            return
+
+        self.image.set_data(rgba)
+        if self.background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.image)
+        self.canvas.blit(self.ax.bbox)
+
+    def on_draw(self, event):
+        # Фон (оси, подписи) запоминается после полной перерисовки, изображение рисуется поверх
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        if self.image is not None:
+            self.ax.draw_artist(self.image)
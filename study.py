@@ -0,0 +1,142 @@
+"""Исследование BraTS: все модальности случая, прочитанные параллельно, и вход модели из них."""
+
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from brats_data import TRAINING_MODALITIES
+from constants import IMG_SIZE
+from preprocessing import allocate_input, copy_slices, normalize_and_resize
+from volume_io import load_volume
+
+# Порядок каналов модели - TRAINING_MODALITIES (FLAIR, T1CE); T1, T2 и разметка необязательны
+IMAGE_MODALITIES = ("flair", "t1ce", "t1", "t2")
+STUDY_MODALITIES = IMAGE_MODALITIES + ("seg",)
+NIFTI_EXTENSIONS = (".nii.gz", ".nii")
+
+
+def strip_nifti_extension(path):
+    name = os.path.basename(path)
+    for ext in NIFTI_EXTENSIONS:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+
+def find_modality(case_dir, modality):
+    # Каталог одного случая; несколько совпадений значат, что в каталоге лежат разные
+    # случаи, и первый попавшийся файл смешал бы каналы разных пациентов
+    for ext in NIFTI_EXTENSIONS:
+        found = sorted(glob.glob(os.path.join(case_dir, f"*_{modality}{ext}")))
+        if len(found) > 1:
+            raise ValueError(f"{case_dir}: несколько файлов *_{modality}{ext} ({', '.join(map(os.path.basename, found))})")
+        if found:
+            return found[0]
+    return None
+
+
+def modality_of(path):
+    name = strip_nifti_extension(path)
+    for modality in STUDY_MODALITIES:
+        if name.endswith("_" + modality):
+            return modality
+    return None
+
+
+def case_prefix(path):
+    # BraTS2021_00000_flair.nii.gz -> BraTS2021_00000; None для файла без модальности в имени
+    modality = modality_of(path)
+    return None if modality is None else strip_nifti_extension(path)[:-len(modality) - 1]
+
+
+def group_case_files(case_dir):
+    # Файлы каталога по случаям: {префикс: {модальность: путь}}. В одном каталоге может
+    # лежать несколько случаев BraTS; .nii.gz предпочтительнее .nii, как в find_modality
+    cases = {}
+    for ext in NIFTI_EXTENSIONS:
+        for path in sorted(glob.glob(os.path.join(case_dir, f"*_*{ext}"))):
+            prefix = case_prefix(path)
+            if prefix is not None and os.path.isfile(path):
+                cases.setdefault(prefix, {}).setdefault(modality_of(path), path)
+    return dict(sorted(cases.items()))
+
+
+def study_files(path):
+    # Каталог случая или любой файл случая -> {модальность: путь}. Соседи файла ищутся
+    # по тому же префиксу (BraTS2021_00000_flair.nii -> BraTS2021_00000_t1ce.nii и т. д.),
+    # отдельный файл без модальности в имени считается каналом FLAIR
+    if os.path.isdir(path):
+        files = {m: find_modality(path, m) for m in STUDY_MODALITIES}
+        return {m: f for m, f in files.items() if f is not None}
+    prefix = case_prefix(path)
+    if prefix is None:
+        return {TRAINING_MODALITIES[0]: path}
+    return group_case_files(os.path.dirname(path) or ".").get(prefix, {})
+
+
+class Study(object):
+    def __init__(self, files, workers=None):
+        self.files = dict(files)
+        self.workers = workers or len(self.files) or 1
+        self.volumes = {}
+
+    @classmethod
+    def open(cls, path, workers=None, modalities=IMAGE_MODALITIES):
+        # Разметку *_seg интерфейс не использует, и по умолчанию она не распаковывается;
+        # явно выбранный файл читается всегда
+        files = {m: f for m, f in study_files(path).items()
+                 if m in modalities or os.path.abspath(f) == os.path.abspath(path)}
+        return cls(files, workers).load()
+
+    def load(self):
+        # Файлы разбираются в отдельных потоках: распаковка gzip в nibabel отпускает GIL,
+        # так что открытие случая стоит примерно как чтение самого большого файла
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="study-load") as pool:
+            futures = {m: pool.submit(load_volume, path) for m, path in self.files.items() if m not in self.volumes}
+            for modality, future in futures.items():
+                self.volumes[modality] = future.result()
+        return self
+
+    @property
+    def reference(self):
+        # Первая модель-модальность: по ней показывается том и берутся заголовок и affine
+        for modality in TRAINING_MODALITIES + STUDY_MODALITIES:
+            if modality in self.volumes:
+                return self.volumes[modality]
+        return None
+
+    def volume_for(self, path):
+        for modality, file_path in self.files.items():
+            if os.path.abspath(file_path) == os.path.abspath(path):
+                return self.volumes[modality]
+        return self.reference
+
+    def missing(self, n_channels):
+        return [m for m in TRAINING_MODALITIES[:n_channels] if m not in self.volumes]
+
+    def channel_volumes(self, n_channels):
+        # Тома каналов модели в исходном разрешении; отсутствующие каналы остаются нулевыми
+        return [self.volumes[m].data if m in self.volumes else None for m in TRAINING_MODALITIES[:n_channels]]
+
+    def model_input(self, n_channels=len(TRAINING_MODALITIES), img_size=IMG_SIZE, out=None):
+        # Один заранее выделенный массив (срезы, img_size, img_size, каналы); каждый канал
+        # нормируется и сжимается в своём потоке (matmul отпускает GIL). С img_size=None
+        # срезы копируются как есть - их сжимает и нормирует сама модель
+        height, width, n_slices = self.reference.shape[:3]
+        if out is None:
+            out = np.zeros((n_slices, height, width, n_channels), dtype=np.float32) if img_size is None \
+                else allocate_input(n_slices, n_channels, img_size)
+        prepare = copy_slices if img_size is None else normalize_and_resize
+        volumes = self.channel_volumes(n_channels)
+        with ThreadPoolExecutor(max_workers=n_channels, thread_name_prefix="study-preprocess") as pool:
+            futures = [pool.submit(prepare, volume, out, channel)
+                       for channel, volume in enumerate(volumes) if volume is not None]
+            for future in futures:
+                future.result()
+        return out
+
+
+def open_study(path, workers=None, modalities=IMAGE_MODALITIES):
+    return Study.open(path, workers, modalities)
@@ -0,0 +1,117 @@
+"""Пространственный индекс разметки: рамки классов, площади и центры опухоли по срезам."""
+
+import numpy as np
+
+from constants import SEGMENT_CLASSES
+
+N_CLASSES = len(SEGMENT_CLASSES)
+
+
+def first_last(nonzero):
+    found = np.flatnonzero(nonzero)
+    return (int(found[0]), int(found[-1])) if found.size else None
+
+
+def next_prev_tables(has_tumor):
+    # next[k] - ближайший срез с опухолью строго после k, prev[k] - строго до k, -1 - нет
+    n = has_tumor.size
+    positions = np.arange(n)
+    after = np.where(has_tumor, positions, n)
+    after = np.minimum.accumulate(after[::-1])[::-1]
+    next_table = np.full(n, -1, dtype=np.int64)
+    next_table[:-1] = np.where(after[1:] < n, after[1:], -1)
+    before = np.maximum.accumulate(np.where(has_tumor, positions, -1))
+    prev_table = np.full(n, -1, dtype=np.int64)
+    prev_table[1:] = before[:-1]
+    return next_table, prev_table
+
+
+class TumorIndex(object):
+    # Считается один раз после сегментации; все запросы навигации - обращения к массивам
+    def __init__(self, labels):
+        labels = np.asarray(labels)
+        self.shape = labels.shape
+
+        # Проекции маски каждого класса на плоскости (0, 1) и (1, 2) дают число вокселей
+        # класса в каждом срезе по всем трём осям; сумма проекций классов - проекции опухоли
+        self.counts = [np.zeros((n, N_CLASSES), dtype=np.int64) for n in self.shape]
+        tumor_01 = np.zeros(self.shape[:2], dtype=np.int64)
+        tumor_12 = np.zeros(self.shape[1:], dtype=np.int64)
+        for cls in range(1, N_CLASSES):
+            # Метка 4 исходной разметки BraTS - тот же класс, что 3 у модели
+            mask = labels >= cls if cls == N_CLASSES - 1 else labels == cls
+            plane_01 = mask.sum(axis=2)
+            plane_12 = mask.sum(axis=0)
+            self.counts[0][:, cls] = plane_01.sum(axis=1)
+            self.counts[1][:, cls] = plane_01.sum(axis=0)
+            self.counts[2][:, cls] = plane_12.sum(axis=0)
+            tumor_01 += plane_01
+            tumor_12 += plane_12
+        for axis in range(3):
+            slice_size = np.prod(self.shape) // self.shape[axis]
+            self.counts[axis][:, 0] = slice_size - self.counts[axis][:, 1:].sum(axis=1)
+
+        self.boxes = {}
+        for cls in range(1, N_CLASSES):
+            box = [first_last(self.counts[axis][:, cls]) for axis in range(3)]
+            self.boxes[cls] = None if box[0] is None else tuple(box)
+        box = [first_last(self.tumor_counts(axis)) for axis in range(3)]
+        self.tumor_box = None if box[0] is None else tuple(box)
+
+        # Центр опухоли в срезе по проекциям маски на три координатные плоскости
+        projections = {2: tumor_01, 1: (labels > 0).sum(axis=1), 0: tumor_12}
+        self.centroids = []
+        for axis in range(3):
+            others = [a for a in range(3) if a != axis]
+            n = self.tumor_counts(axis).astype(np.float64)
+            centroid = np.full((self.shape[axis], 2), np.nan)
+            for i, other in enumerate(others):
+                # Проекция на плоскость (axis, other): сумма по третьей оси
+                third = 3 - axis - other
+                plane = projections[third]
+                plane = plane if axis < other else plane.T
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    centroid[:, i] = plane @ np.arange(self.shape[other]) / n
+            self.centroids.append(centroid)
+
+        self.next_table, self.prev_table = [], []
+        for axis in range(3):
+            next_table, prev_table = next_prev_tables(self.tumor_counts(axis) > 0)
+            self.next_table.append(next_table)
+            self.prev_table.append(prev_table)
+
+    def tumor_counts(self, axis):
+        return self.counts[axis][:, 1:].sum(axis=1)
+
+    def is_empty(self):
+        return self.tumor_box is None
+
+    def next_slice(self, axis, index):
+        k = self.next_table[axis][index]
+        return None if k < 0 else int(k)
+
+    def prev_slice(self, axis, index):
+        k = self.prev_table[axis][index]
+        return None if k < 0 else int(k)
+
+    def largest_slice(self, axis):
+        if self.is_empty():
+            return None
+        return int(np.argmax(self.tumor_counts(axis)))
+
+    def largest_slices(self, axis, n, min_gap=None):
+        # Срезы с наибольшим сечением опухоли, не ближе min_gap друг к другу,
+        # чтобы в отчёт не попали три соседних почти одинаковых среза
+        counts = self.tumor_counts(axis)
+        if min_gap is None:
+            extent = self.tumor_box[axis] if self.tumor_box is not None else (0, 0)
+            min_gap = max(1, (extent[1] - extent[0]) // (2 * n))
+        chosen = []
+        for k in np.argsort(counts, kind="stable")[::-1]:
+            if counts[k] == 0:
+                break
+            if all(abs(int(k) - c) >= min_gap for c in chosen):
+                chosen.append(int(k))
+                if len(chosen) == n:
+                    break
+        return chosen
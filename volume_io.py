@@ -0,0 +1,124 @@
+"""Загрузка и сохранение томов NIfTI без копии в float64."""
+
+import gzip
+import os
+
+import nibabel as nib
+import numpy as np
+
+LABEL_DTYPE = np.uint8
+# Уровень gzip по умолчанию: 6 почти не уступает 9 по размеру и заметно быстрее
+DEFAULT_COMPRESSLEVEL = 6
+
+
+class Volume(object):
+    def __init__(self, path):
+        self.path = path
+        # Для несжатого .nii dataobj отдаёт memmap в исходном типе данных,
+        # для .nii.gz том один раз распаковывается, тоже без перевода в float64
+        self.image = nib.load(path, mmap=True)
+        data = np.asanyarray(self.image.dataobj)
+        while data.ndim > 3:
+            data = data[..., 0]
+        self.data = data
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def affine(self):
+        return self.image.affine
+
+    @property
+    def header(self):
+        return self.image.header
+
+
+def load_volume(path):
+    return Volume(path)
+
+
+def resized_affine(affine, in_shape, out_shape):
+    # Учитываем изменение размера вокселя в плоскости среза после ресемплинга
+    scaling = np.eye(4)
+    for axis in range(2):
+        scale = in_shape[axis] / out_shape[axis]
+        scaling[axis, axis] = scale
+        scaling[axis, 3] = (scale - 1) / 2
+    return affine @ scaling
+
+
+class ProgressFile(object):
+    # Обёртка над файлом, считающая записанные (несжатые) байты
+    def __init__(self, fileobj, total, progress):
+        self.fileobj = fileobj
+        self.total = total
+        self.written = 0
+        self.progress = progress
+
+    def write(self, data):
+        n = self.fileobj.write(data)
+        self.written += len(memoryview(data).cast("B"))
+        self.progress(min(self.written, self.total), self.total)
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+def make_image(data, reference=None, dtype=None):
+    # Заголовок и аффинная матрица берутся из исходного тома; если срезы были
+    # сжаты (например, до IMG_SIZE), размер вокселя пересчитывается
+    dtype = np.dtype(dtype or data.dtype)
+    if reference is None:
+        header = nib.Nifti1Header()
+        affine = np.eye(4)
+    else:
+        header = nib.Nifti1Header.from_header(reference.header)
+        affine = reference.affine
+        if tuple(data.shape[:2]) != tuple(reference.shape[:2]):
+            affine = resized_affine(affine, reference.shape, data.shape)
+    header.set_data_dtype(dtype)
+    image = nib.Nifti1Image(data, affine, header)
+    if dtype == LABEL_DTYPE:
+        image.header.set_slope_inter(1, 0)
+    return image
+
+
+def save_volume(data, path, reference=None, dtype=None, compresslevel=DEFAULT_COMPRESSLEVEL, progress=None):
+    # .nii.gz сжимается с заданным уровнем, .nii пишется без сжатия; запись идёт
+    # во временный файл, чтобы прерванное сохранение не испортило существующий
+    image = make_image(data, reference, dtype)
+    partial_path = path + ".partial"
+    with open(partial_path, "wb") as raw:
+        if path.endswith(".gz"):
+            fileobj = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=compresslevel, mtime=0)
+        else:
+            fileobj = raw
+        try:
+            target = fileobj
+            if progress is not None:
+                header = image.header
+                offset = header.single_vox_offset + sum(e.get_sizeondisk() for e in header.extensions)
+                total = offset + data.size * header.get_data_dtype().itemsize
+                target = ProgressFile(fileobj, total, progress)
+            image.to_file_map({"image": nib.FileHolder(path, target)})
+        finally:
+            if fileobj is not raw:
+                fileobj.close()
+    os.replace(partial_path, path)
+    return path
+
+
+def save_labels(labels, path, reference=None, compresslevel=DEFAULT_COMPRESSLEVEL, progress=None):
+    return save_volume(np.asarray(labels, dtype=LABEL_DTYPE), path, reference, LABEL_DTYPE, compresslevel, progress)
+
+
+def save_intensities(volume, path, compresslevel=DEFAULT_COMPRESSLEVEL, progress=None):
+    # Интенсивности сохраняются в типе исходного файла (со шкалой из его заголовка)
+    return save_volume(volume.data, path, volume, volume.image.get_data_dtype(), compresslevel, progress)
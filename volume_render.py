@@ -0,0 +1,85 @@
+"""Подготовка тома для GLVolumeItem: uint8 RGBA за один проход и уровни детализации."""
+
+import numpy as np
+import pyqtgraph.opengl as gl
+from PyQt5 import QtCore
+
+RENDER_TYPE = "translucent"
+THR_MIN = 1
+THR_MAX = 2000
+
+# Полный размер в покое и 1/2 по каждой оси во время вращения
+LOD_FACTORS = (1, 2)
+INTERACTION_LEVEL = 1
+IDLE_MS = 300
+CHUNK_ROWS = 16
+
+
+def prepare_rgba(data, thr_min=THR_MIN, thr_max=THR_MAX):
+    # Исходный массив не изменяется: блоки по CHUNK_ROWS срезов считаются отдельно
+    # и сразу записываются в итоговый uint8 RGBA
+    half_x = data.shape[0] // 2
+    source = data[:half_x, ::-1, :]
+    rgba = np.empty(source.shape + (4,), dtype=np.uint8)
+
+    for start in range(0, half_x, CHUNK_ROWS):
+        block = np.asarray(source[start:start + CHUNK_ROWS])
+        alpha = np.clip(block.astype(np.float64), thr_min, thr_max)
+        alpha[block == 0] = thr_min
+        alpha -= thr_min
+        alpha /= thr_max - thr_min
+        alpha *= 255
+        rgba[start:start + CHUNK_ROWS] = alpha.astype(np.uint8)[..., np.newaxis]  # RGB = прозрачность
+
+    rgba[:40, 0, 0] = [255, 0, 0, 255]
+    rgba[0, :40, 0] = [0, 255, 0, 255]
+    rgba[0, 0, :40] = [0, 0, 255, 255]
+    return rgba
+
+
+def build_lods(rgba):
+    return [rgba] + [np.ascontiguousarray(rgba[::f, ::f, ::f]) for f in LOD_FACTORS[1:]]
+
+
+class LodVolume(QtCore.QObject):
+    # Во время вращения и масштабирования показывается грубый уровень,
+    # полный загружается в GL после паузы
+    def __init__(self, view, levels, gl_options=RENDER_TYPE):
+        super().__init__(view)
+        self.view = view
+        self.levels = levels
+        self.full_shape = levels[0].shape[:3]
+        self.level = None
+
+        self.item = gl.GLVolumeItem(levels[INTERACTION_LEVEL], sliceDensity=6, smooth=False, glOptions=gl_options)
+        self.show_level(INTERACTION_LEVEL)
+        view.addItem(self.item)
+
+        self.idle_timer = QtCore.QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(IDLE_MS)
+        self.idle_timer.timeout.connect(lambda: self.show_level(0))
+        self.idle_timer.start()
+        view.installEventFilter(self)
+
+    def show_level(self, level):
+        if level == self.level:
+            return
+        self.level = level
+        factor = LOD_FACTORS[level]
+        self.item.setData(self.levels[level])
+        self.item.resetTransform()
+        self.item.scale(factor, factor, factor)
+        self.item.translate(dx=-self.full_shape[0]/2, dy=-self.full_shape[1]/2, dz=-self.full_shape[2]/3)
+
+    def eventFilter(self, obj, event):
+        if event.type() in (QtCore.QEvent.MouseButtonPress, QtCore.QEvent.Wheel) or (
+                event.type() == QtCore.QEvent.MouseMove and event.buttons()):
+            self.show_level(INTERACTION_LEVEL)
+            self.idle_timer.start()
+        return False
+
+    def detach(self):
+        self.idle_timer.stop()
+        self.view.removeEventFilter(self)
+        self.deleteLater()